@@ -1,19 +1,35 @@
-import re, os, requests
-from io import BytesIO
+import config
+# `GEVENT=1 python Code.py` serves on gevent; patching has to happen before
+# anything below imports socket, ssl or threading.
+if __name__ == '__main__' and config.GEVENT:
+    from gevent import monkey
+    monkey.patch_all()
+
+import re, os, requests, hashlib, base64, select, gzip, mimetypes
+from requests.adapters import HTTPAdapter
+from io import BytesIO, StringIO
 from functools import wraps
-import json, qrcode, time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import json, qrcode, time, threading, itertools, zipfile, socket
+import click
 from flask_cors import CORS 
 
 from flask import (
     Flask, render_template, request, redirect, url_for, session,
-    flash, send_file, jsonify, make_response, abort, current_app
+    flash, send_file, jsonify, make_response, abort, current_app,
+    g, has_app_context, Response, stream_with_context, send_from_directory
 )
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import execute_values
 import pandas as pd
-
-import config
+from PIL import Image, ImageDraw, ImageFont, ImageOps, features
 
 app = Flask(__name__)
 app.config.from_object('config')
@@ -22,86 +38,323 @@ UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 CORS(app)
 
-# DB connection helper
+# DB connection pool
+def _gevent_mode_enabled():
+    mode = str(config.DB_POOL_GEVENT).lower()
+    if mode in ('1', 'true', 'yes'):
+        return True
+    if mode in ('0', 'false', 'no'):
+        return False
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def _gevent_wait_callback(conn, timeout=None):
+    """psycopg2 wait callback that yields to the gevent hub instead of blocking the process."""
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+class DBConnectionPool:
+    """Bounded pool of psycopg2 connections with health checks and wait-time stats."""
+
+    def __init__(self, minconn, maxconn, timeout, healthcheck_interval, use_gevent=False, **conn_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.use_gevent = use_gevent
+        self._conn_kwargs = conn_kwargs
+
+        if use_gevent:
+            from gevent.lock import BoundedSemaphore, RLock
+            # Process-wide: every connection goes green. psycopg2 then refuses
+            # COPY, so bulk_upsert_students() stages rows with INSERTs instead.
+            psycopg2.extensions.set_wait_callback(_gevent_wait_callback)
+            self._slots = BoundedSemaphore(maxconn)
+            self._lock = RLock()
+        else:
+            self._slots = threading.BoundedSemaphore(maxconn)
+            self._lock = threading.RLock()
+
+        self._idle = deque()  # (connection, last_used)
+        self._in_use = set()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'healthcheck_failures': 0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._conn_kwargs)
+        with self._lock:
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._stats['connections_discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._lock:
+                self._stats['healthcheck_failures'] += 1
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise psycopg2.pool.PoolError(
+                f"Timed out after {self.timeout}s waiting for a database connection"
+            )
+        waited = time.monotonic() - started
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    candidate = self._idle.pop() if self._idle else None
+                if candidate is None:
+                    conn = self._connect()
+                elif self._is_healthy(*candidate):
+                    conn = candidate[0]
+                else:
+                    self._discard(candidate[0])
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use.add(conn)
+            self._stats['checkouts'] += 1
+            if waited > 0.001:
+                self._stats['waits'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return conn
+
+    def putconn(self, conn):
+        with self._lock:
+            if conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+
+        try:
+            if not conn.closed:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    self._discard(conn)
+                    return
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'min': self.minconn,
+                'max': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'gevent': self.use_gevent,
+            })
+        checkouts = stats['checkouts'] or 1
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts
+        return stats
+
+
+class PooledConnection:
+    """Proxy for a pooled connection; close() hands it back to the pool instead of disconnecting."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    @property
+    def released(self):
+        return self._conn is None
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = DBConnectionPool(
+                    config.DB_POOL_MIN,
+                    config.DB_POOL_MAX,
+                    timeout=config.DB_POOL_TIMEOUT,
+                    healthcheck_interval=config.DB_POOL_HEALTHCHECK_INTERVAL,
+                    use_gevent=_gevent_mode_enabled(),
+                    host=config.DB_HOST,
+                    dbname=config.DB_NAME,
+                    user=config.DB_USER,
+                    password=config.DB_PASSWORD
+                )
+    return _db_pool
+
+
+# DB connection helper: checks a connection out of the pool. Inside a request
+# every checkout is tracked on `g` and handed back at teardown, so error paths
+# that skip conn.close() no longer leak connections.
 def get_db_connection():
-    return psycopg2.connect(
-        host=config.DB_HOST,
-        dbname=config.DB_NAME,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD
-    )
+    conn = PooledConnection(get_db_pool(), get_db_pool().getconn())
+    if has_app_context():
+        g.setdefault('_db_connections', []).append(conn)
+    return conn
+
+
+@app.teardown_appcontext
+def release_db_connections(exc):
+    for conn in g.pop('_db_connections', []):
+        conn.close()
 
 # Initialize the DB (call once or at startup)
 def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"')
-    # batches, departments tables for filtering
-    cur.execute('''
+    """Create or upgrade the schema; the base tables are migration 0."""
+    run_migrations()
+
+
+# Degree shown when a student's department has none; migration 3 bakes it
+# into student_cards.degree.
+DEFAULT_DEGREE = "Bachelor of Engineering Technology"
+
+# Versioned schema migrations, applied in version order (0 is the base tables).
+# Each entry is (version, description, online, statements). Online
+# migrations run statement by statement in autocommit, as CREATE INDEX
+# CONCURRENTLY requires; the others run in one transaction. Statements must
+# be idempotent so an interrupted migration can simply be run again.
+MIGRATIONS = [
+    # Base tables. Idempotent, so it is also safe on databases created by
+    # the old init_db() DDL; it runs first so later migrations can rely on
+    # students.qr_hash (3) and import_jobs (5).
+    (0, 'base schema', False, [
+        'CREATE EXTENSION IF NOT EXISTS "uuid-ossp"',
+        """
         CREATE TABLE IF NOT EXISTS batches (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL UNIQUE
-        );
-    ''')
-    cur.execute('''
+          id SERIAL PRIMARY KEY,
+          name TEXT NOT NULL UNIQUE
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS departments (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL UNIQUE,
-            degree TEXT NOT NULL
-        );
-    ''')
-    # users table for admin/teachers/students auth
-    cur.execute('''
+          id SERIAL PRIMARY KEY,
+          name TEXT NOT NULL UNIQUE,
+          degree TEXT NOT NULL
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            email TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL,
-            batch_id INTEGER,
-            department_id INTEGER,
-            batch_status TEXT,
-            admission_date TEXT,
-            FOREIGN KEY (batch_id) REFERENCES batches(id),
-            FOREIGN KEY (department_id) REFERENCES departments(id)
-        );
-
-    ''')
-    # students table as requested
-    cur.execute('''
+          id TEXT PRIMARY KEY,
+          name TEXT NOT NULL,
+          email TEXT NOT NULL UNIQUE,
+          password TEXT NOT NULL,
+          role TEXT NOT NULL,
+          batch_id INTEGER,
+          department_id INTEGER,
+          batch_status TEXT,
+          admission_date TEXT,
+          FOREIGN KEY (batch_id) REFERENCES batches(id),
+          FOREIGN KEY (department_id) REFERENCES departments(id)
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS students (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            password TEXT,
-            role TEXT DEFAULT 'student',
-            father_name TEXT,
-            caste TEXT,
-            cnic TEXT UNIQUE,
-            roll_no TEXT UNIQUE,
-            batch TEXT,
-            department TEXT,
-            year TEXT,
-            enrollment TEXT,
-            emergency_contact TEXT,
-            relation TEXT,
-            blood_group TEXT,
-            address TEXT,
-            image_path TEXT,
-            qr_code TEXT
-        );
-
-    ''')
-    cur.execute('''
+          id SERIAL PRIMARY KEY,
+          name TEXT NOT NULL,
+          email TEXT UNIQUE,
+          password TEXT,
+          role TEXT DEFAULT 'student',
+          father_name TEXT,
+          caste TEXT,
+          cnic TEXT UNIQUE,
+          roll_no TEXT UNIQUE,
+          batch TEXT,
+          department TEXT,
+          year TEXT,
+          enrollment TEXT,
+          emergency_contact TEXT,
+          relation TEXT,
+          blood_group TEXT,
+          address TEXT,
+          image_path TEXT,
+          qr_code TEXT
+        )
+        """,
+        "ALTER TABLE students ADD COLUMN IF NOT EXISTS qr_hash TEXT",
+        """
         CREATE TABLE IF NOT EXISTS agent_sessions (
           id SERIAL PRIMARY KEY,
           admin_user_id TEXT,
           started_at TIMESTAMPTZ DEFAULT now(),
           ended_at TIMESTAMPTZ,
           initial_query TEXT
-        );
-    ''')
-    cur.execute('''
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS agent_actions (
           id SERIAL PRIMARY KEY,
           session_id INT REFERENCES agent_sessions(id),
@@ -109,10 +362,25 @@ def init_db():
           action_payload JSONB,
           result JSONB,
           created_at TIMESTAMPTZ DEFAULT now()
-        );
-    ''')
-
-    cur.execute('''
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+          id TEXT PRIMARY KEY,
+          admin_user_id TEXT,
+          filename TEXT,
+          status TEXT NOT NULL DEFAULT 'queued',
+          rows_processed INTEGER NOT NULL DEFAULT 0,
+          inserted INTEGER NOT NULL DEFAULT 0,
+          updated INTEGER NOT NULL DEFAULT 0,
+          skipped INTEGER NOT NULL DEFAULT 0,
+          errors JSONB NOT NULL DEFAULT '[]'::jsonb,
+          created_at TIMESTAMPTZ DEFAULT now(),
+          started_at TIMESTAMPTZ,
+          finished_at TIMESTAMPTZ
+        )
+        """,
+        """
         CREATE TABLE IF NOT EXISTS audit_logs (
           id SERIAL PRIMARY KEY,
           admin_user_id TEXT,
@@ -120,27 +388,446 @@ def init_db():
           target TEXT,
           details JSONB,
           created_at TIMESTAMPTZ DEFAULT now()
-        );
-    ''')
-
-    conn.commit()
+        )
+        """,
+    ]),
+    (1, 'students listing and filter indexes', True, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_students_batch_department_name "
+        "ON students (batch, department, name, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_students_name_id ON students (name, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_students_roll_no_prefix ON students (roll_no text_pattern_ops)",
+    ]),
+    (2, 'case-insensitive department and user lookups', True, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_departments_lower_name ON departments (LOWER(name))",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_lower_email ON users (LOWER(email))",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_admin ON users (id) WHERE role = 'admin'",
+    ]),
+    (3, 'student_cards read model maintained by triggers', False, [
+        """
+        CREATE TABLE IF NOT EXISTS student_cards (
+          id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+          name TEXT NOT NULL,
+          father_name TEXT, caste TEXT, cnic TEXT, roll_no TEXT,
+          department TEXT, batch TEXT, year TEXT, enrollment TEXT,
+          emergency_contact TEXT, relation TEXT, blood_group TEXT, address TEXT,
+          image_path TEXT, qr_code TEXT, qr_hash TEXT,
+          department_degree TEXT,
+          degree TEXT NOT NULL,
+          version BIGINT NOT NULL DEFAULT 1,
+          updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_student_cards_batch_department ON student_cards (batch, department, name, id)",
+        "CREATE INDEX IF NOT EXISTS idx_student_cards_name_id ON student_cards (name, id)",
+        "CREATE INDEX IF NOT EXISTS idx_student_cards_roll_no_prefix ON student_cards (roll_no text_pattern_ops)",
+        # Upserts the cards for the rows in the statement's transition table.
+        f"""
+        CREATE OR REPLACE FUNCTION student_cards_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          INSERT INTO student_cards AS c (
+            id, name, father_name, caste, cnic, roll_no, department, batch, year, enrollment,
+            emergency_contact, relation, blood_group, address, image_path, qr_code, qr_hash,
+            department_degree, degree)
+          SELECT s.id, s.name, s.father_name, s.caste, s.cnic, s.roll_no, s.department, s.batch, s.year,
+                 s.enrollment, s.emergency_contact, s.relation, s.blood_group, s.address, s.image_path,
+                 s.qr_code, s.qr_hash, d.degree, COALESCE(NULLIF(d.degree, ''), '{DEFAULT_DEGREE}')
+          FROM changed_students s
+          LEFT JOIN LATERAL (
+            SELECT degree FROM departments WHERE LOWER(name) = LOWER(s.department) LIMIT 1
+          ) d ON true
+          ON CONFLICT (id) DO UPDATE SET
+            name = EXCLUDED.name, father_name = EXCLUDED.father_name, caste = EXCLUDED.caste,
+            cnic = EXCLUDED.cnic, roll_no = EXCLUDED.roll_no, department = EXCLUDED.department,
+            batch = EXCLUDED.batch, year = EXCLUDED.year, enrollment = EXCLUDED.enrollment,
+            emergency_contact = EXCLUDED.emergency_contact, relation = EXCLUDED.relation,
+            blood_group = EXCLUDED.blood_group, address = EXCLUDED.address,
+            image_path = EXCLUDED.image_path, qr_code = EXCLUDED.qr_code, qr_hash = EXCLUDED.qr_hash,
+            department_degree = EXCLUDED.department_degree, degree = EXCLUDED.degree,
+            version = c.version + 1, updated_at = now();
+          RETURN NULL;
+        END $$
+        """,
+        # Re-resolves the degree of every card whose department's degree changed.
+        f"""
+        CREATE OR REPLACE FUNCTION student_cards_departments_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          UPDATE student_cards c
+          SET department_degree = r.degree,
+              degree = COALESCE(NULLIF(r.degree, ''), '{DEFAULT_DEGREE}'),
+              version = c.version + 1, updated_at = now()
+          FROM (
+            SELECT c2.id, (SELECT degree FROM departments
+                           WHERE LOWER(name) = LOWER(c2.department) LIMIT 1) AS degree
+            FROM student_cards c2
+          ) r
+          WHERE c.id = r.id AND c.department_degree IS DISTINCT FROM r.degree;
+          RETURN NULL;
+        END $$
+        """,
+        "DROP TRIGGER IF EXISTS student_cards_insert ON students",
+        "CREATE TRIGGER student_cards_insert AFTER INSERT ON students "
+        "REFERENCING NEW TABLE AS changed_students FOR EACH STATEMENT EXECUTE FUNCTION student_cards_sync()",
+        "DROP TRIGGER IF EXISTS student_cards_update ON students",
+        "CREATE TRIGGER student_cards_update AFTER UPDATE ON students "
+        "REFERENCING NEW TABLE AS changed_students FOR EACH STATEMENT EXECUTE FUNCTION student_cards_sync()",
+        "DROP TRIGGER IF EXISTS student_cards_departments ON departments",
+        "CREATE TRIGGER student_cards_departments AFTER INSERT OR UPDATE OR DELETE ON departments "
+        "FOR EACH STATEMENT EXECUTE FUNCTION student_cards_departments_sync()",
+        # Backfill existing students straight into the read model; touching every
+        # student row instead would rewrite and lock the whole table.
+        f"""
+        INSERT INTO student_cards (
+          id, name, father_name, caste, cnic, roll_no, department, batch, year, enrollment,
+          emergency_contact, relation, blood_group, address, image_path, qr_code, qr_hash,
+          department_degree, degree)
+        SELECT s.id, s.name, s.father_name, s.caste, s.cnic, s.roll_no, s.department, s.batch, s.year,
+               s.enrollment, s.emergency_contact, s.relation, s.blood_group, s.address, s.image_path,
+               s.qr_code, s.qr_hash, d.degree, COALESCE(NULLIF(d.degree, ''), '{DEFAULT_DEGREE}')
+        FROM students s
+        LEFT JOIN LATERAL (
+          SELECT degree FROM departments WHERE LOWER(name) = LOWER(s.department) LIMIT 1
+        ) d ON true
+        ON CONFLICT (id) DO NOTHING
+        """,
+    ]),
+    (4, 'notify reference-data listeners on batch/department changes', False, [
+        """
+        CREATE OR REPLACE FUNCTION notify_reference_data() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          PERFORM pg_notify('reference_data', TG_TABLE_NAME);
+          RETURN NULL;
+        END $$
+        """,
+        "DROP TRIGGER IF EXISTS batches_notify ON batches",
+        "CREATE TRIGGER batches_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON batches "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data()",
+        "DROP TRIGGER IF EXISTS departments_notify ON departments",
+        "CREATE TRIGGER departments_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON departments "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data()",
+    ]),
+    (5, 'import job ownership for restart recovery', False, [
+        "ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS owner TEXT",
+        "ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ DEFAULT now()",
+    ]),
+    # Any change to a card, including one made outside Flask (the n8n agents,
+    # psql) or through the departments trigger, drops its cached previews
+    # on every worker. Payload format matches invalidate_previews().
+    (6, 'notify preview caches on student_cards changes', False, [
+        """
+        CREATE OR REPLACE FUNCTION notify_preview_cache() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+          ids TEXT;
+        BEGIN
+          IF TG_OP = 'DELETE' THEN
+            SELECT string_agg(id::text, ',') INTO ids FROM old_cards;
+          ELSE
+            SELECT string_agg(id::text, ',') INTO ids FROM new_cards;
+          END IF;
+          IF ids IS NOT NULL THEN
+            PERFORM pg_notify('preview_cache', CASE WHEN length(ids) > 7000 THEN '*' ELSE ids END);
+          END IF;
+          RETURN NULL;
+        END $$
+        """,
+        "DROP TRIGGER IF EXISTS student_cards_preview_update ON student_cards",
+        "CREATE TRIGGER student_cards_preview_update AFTER UPDATE ON student_cards "
+        "REFERENCING NEW TABLE AS new_cards FOR EACH STATEMENT EXECUTE FUNCTION notify_preview_cache()",
+        "DROP TRIGGER IF EXISTS student_cards_preview_delete ON student_cards",
+        "CREATE TRIGGER student_cards_preview_delete AFTER DELETE ON student_cards "
+        "REFERENCING OLD TABLE AS old_cards FOR EACH STATEMENT EXECUTE FUNCTION notify_preview_cache()",
+    ]),
+    (7, 'card export progress shared by all workers', False, [
+        """
+        CREATE TABLE IF NOT EXISTS export_jobs (
+          id TEXT PRIMARY KEY,
+          status TEXT NOT NULL DEFAULT 'running',
+          total INTEGER NOT NULL DEFAULT 0,
+          range_start INTEGER NOT NULL DEFAULT 0,
+          range_end INTEGER NOT NULL DEFAULT 0,
+          done INTEGER NOT NULL DEFAULT 0,
+          bytes BIGINT NOT NULL DEFAULT 0,
+          error TEXT,
+          started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+          updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_export_jobs_updated_at ON export_jobs (updated_at)",
+    ]),
+]
+
+MIGRATION_LOCK_ID = 0x5354_4944  # pg_advisory_lock key, one runner at a time
+_CONCURRENT_INDEX_RE = re.compile(r'CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+)', re.IGNORECASE)
+
+def _drop_invalid_index(cur, statement):
+    """A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind that
+    IF NOT EXISTS would skip; drop it so the statement rebuilds it."""
+    match = _CONCURRENT_INDEX_RE.search(statement)
+    if not match:
+        return
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (match.group(1),))
+    if cur.fetchone():
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+def run_migrations(log=None):
+    """Apply pending MIGRATIONS; returns the versions applied by this call."""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    applied_now = []
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                  version INTEGER PRIMARY KEY,
+                  description TEXT,
+                  applied_at TIMESTAMPTZ DEFAULT now()
+                )
+            """)
+            cur.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cur.fetchall()}
+
+            for version, description, online, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                if log:
+                    log(f"Applying migration {version}: {description}")
+                if online:
+                    for statement in statements:
+                        _drop_invalid_index(cur, statement)
+                        cur.execute(statement)
+                else:
+                    conn.autocommit = False
+                    for statement in statements:
+                        cur.execute(statement)
+                    conn.commit()
+                    conn.autocommit = True
+                cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s) "
+                            "ON CONFLICT (version) DO NOTHING", (version, description))
+                applied_now.append(version)
+        finally:
+            if not conn.closed and conn.autocommit is False:
+                conn.rollback()
+                conn.autocommit = True
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            cur.close()
+    finally:
+        if not conn.closed:
+            conn.autocommit = False
+        pool.putconn(conn)
+    return applied_now
+
+# Representative hot queries for `flask migrate --explain`.
+HOT_QUERIES = {
+    'generate_id page (batch + department)': ("""
+        SELECT s.id, s.name, s.department_degree FROM student_cards s
+        WHERE s.batch = %s AND s.department = %s ORDER BY s.name, s.id LIMIT 51
+    """, ('2023', 'Artificial Intelligence')),
+    'generate_id page (no filter, keyset)': ("""
+        SELECT s.id, s.name FROM student_cards s WHERE (s.name, s.id) > (%s, %s) ORDER BY s.name, s.id LIMIT 51
+    """, ('M', 0)),
+    'generate_id roll_no prefix': ("""
+        SELECT s.id FROM student_cards s WHERE s.roll_no LIKE %s ORDER BY s.name, s.id LIMIT 51
+    """, ('23-BS-AI%',)),
+    'card data by id': ("SELECT s.degree FROM student_cards s WHERE s.id = ANY(%s)", ([1],)),
+    'departments by name (card read-model sync)': (
+        "SELECT degree FROM departments WHERE LOWER(name) = LOWER(%s) LIMIT 1", ('Artificial Intelligence',)),
+    'login by email': ("SELECT id FROM users WHERE LOWER(email) = %s", ('admin@example.com',)),
+    'admin_exists': ("SELECT 1 FROM users WHERE role = %s LIMIT 1", ('admin',)),
+}
+
+def explain_hot_queries():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    plans = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        cur.execute("EXPLAIN " + sql, params)
+        plans[name] = [row[0] for row in cur.fetchall()]
     cur.close()
     conn.close()
+    return plans
+
+@app.cli.command('migrate')
+@click.option('--explain', is_flag=True, help='Print EXPLAIN plans of the hot queries before and after.')
+def migrate_command(explain):
+    """Apply pending schema migrations."""
+    def print_plans(title):
+        click.echo(f"== {title} ==")
+        for name, plan in explain_hot_queries().items():
+            click.echo(f"-- {name}")
+            for line in plan:
+                click.echo(f"   {line}")
+
+    if explain:
+        print_plans('before')
+    applied = run_migrations(log=click.echo)
+    click.echo(f"Applied {len(applied)} migration(s)." if applied else "Schema is up to date.")
+    if explain:
+        print_plans('after')
+
+
+# helper: check admin existence. The answer is cached per process: once an
+# admin exists it stays True until invalidated, while a False answer is only
+# trusted for ADMIN_EXISTS_TTL seconds so other workers pick up a new admin.
+_admin_exists_cache = {'value': None, 'checked_at': 0.0}
+_admin_exists_lock = threading.Lock()
+
+def admin_exists(refresh=False):
+    with _admin_exists_lock:
+        value = _admin_exists_cache['value']
+        age = time.monotonic() - _admin_exists_cache['checked_at']
+    if not refresh and (value or (value is False and age < config.ADMIN_EXISTS_TTL)):
+        return value
 
-
-# helper: check admin existence
-def admin_exists():
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT 1 FROM users WHERE role = %s LIMIT 1", ('admin',))
     exists = cur.fetchone() is not None
     cur.close()
     conn.close()
+    set_admin_exists(exists)
     return exists
 
+def set_admin_exists(value):
+    with _admin_exists_lock:
+        _admin_exists_cache['value'] = value
+        _admin_exists_cache['checked_at'] = time.monotonic()
+
+def invalidate_admin_exists():
+    with _admin_exists_lock:
+        _admin_exists_cache['value'] = None
+        _admin_exists_cache['checked_at'] = 0.0
+
+class _LazyAdminExists:
+    """Template flag that only looks up admin_exists() when a template actually tests it."""
+    def __bool__(self):
+        return admin_exists()
+
+    def __str__(self):
+        return str(bool(self))
+
 @app.context_processor
 def inject_admin_exists():
-    return dict(admin_exists=admin_exists())
+    return dict(admin_exists=_LazyAdminExists())
+
+# Cross-worker cache invalidation. One daemon thread per process LISTENs on
+# every channel in NOTIFY_HANDLERS and passes each payload to its handler.
+# Caches built on it only keep entries while change_listener_ready() is True;
+# on every (re)connect and disconnect each handler is called with None, so
+# nothing cached across a gap in notifications survives.
+NOTIFY_HANDLERS = {}
+_change_listener = {'thread': None, 'listening': False}
+_change_listener_lock = threading.Lock()
+
+def _reset_notify_handlers():
+    for handler in NOTIFY_HANDLERS.values():
+        handler(None)
+
+def _listen_for_changes():
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(host=config.DB_HOST, dbname=config.DB_NAME,
+                                    user=config.DB_USER, password=config.DB_PASSWORD)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for channel in NOTIFY_HANDLERS:
+                    cur.execute(f"LISTEN {channel}")
+            # anything cached before LISTEN took effect may already be stale
+            _reset_notify_handlers()
+            with _change_listener_lock:
+                _change_listener['listening'] = True
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    NOTIFY_HANDLERS[notify.channel](notify.payload)
+        except Exception:
+            app.logger.warning("Change listener disconnected; caches disabled until it reconnects", exc_info=True)
+        finally:
+            with _change_listener_lock:
+                _change_listener['listening'] = False
+            _reset_notify_handlers()
+            if conn is not None and not conn.closed:
+                conn.close()
+        time.sleep(config.NOTIFY_LISTEN_RETRY)
+
+def change_listener_ready():
+    """Start the listener thread if needed; True once it is receiving notifications."""
+    with _change_listener_lock:
+        if _change_listener['thread'] is None:
+            _change_listener['thread'] = threading.Thread(target=_listen_for_changes,
+                                                          name='change-listener', daemon=True)
+            _change_listener['thread'].start()
+        return _change_listener['listening']
+
+
+# Reference data: batch and department names for the dropdowns, cached per
+# process. Writes to either table fire pg_notify('reference_data', <table>)
+# (migration 4), so every worker drops the entry as soon as the change
+# commits. While the listener is not connected every call reads the database.
+REFERENCE_QUERIES = {
+    'batches': "SELECT name FROM batches ORDER BY name",
+    'departments': "SELECT name FROM departments ORDER BY name",
+}
+REFERENCE_CHANNEL = 'reference_data'
+
+_reference_cache = {}
+_reference_state = {'generation': 0, 'hits': 0, 'misses': 0, 'invalidations': 0}
+_reference_lock = threading.Lock()
+
+def invalidate_reference_data(kind=None):
+    with _reference_lock:
+        if kind is None:
+            _reference_cache.clear()
+        else:
+            _reference_cache.pop(kind, None)
+        _reference_state['generation'] += 1
+        _reference_state['invalidations'] += 1
+
+NOTIFY_HANDLERS[REFERENCE_CHANNEL] = lambda payload: invalidate_reference_data(
+    payload if payload in REFERENCE_QUERIES else None)
+
+def reference_names(kind):
+    """Names from the batches or departments table, ordered by name."""
+    use_cache = config.REFERENCE_CACHE_ENABLED and change_listener_ready()
+    if use_cache:
+        with _reference_lock:
+            names = _reference_cache.get(kind)
+            if names is not None:
+                _reference_state['hits'] += 1
+                return list(names)
+            _reference_state['misses'] += 1
+            generation = _reference_state['generation']
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(REFERENCE_QUERIES[kind])
+    names = [r[0] for r in cur.fetchall()]
+    cur.close()
+    conn.close()
+
+    if use_cache:
+        with _reference_lock:
+            # don't store a result an invalidation raced with
+            if _reference_state['generation'] == generation:
+                _reference_cache[kind] = names
+    return list(names)
+
+def reference_data_stats():
+    with _reference_lock:
+        stats = {k: v for k, v in _reference_state.items() if k != 'generation'}
+        stats['cached'] = sorted(_reference_cache)
+    stats['listening'] = _change_listener['listening']
+    return stats
 
 # simple decorator for role-based access
 def role_required(*roles):
@@ -177,14 +864,8 @@ import uuid
 
 @app.route('/create_admin', methods=['GET', 'POST'])
 def create_admin():
-    # Step 1: Check if admin exists
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE role = %s", ('admin',))
-    admin = cursor.fetchone()
-    conn.close()
-
-    if admin:
+    # Step 1: Check if admin exists (always ask the DB; the cache may be stale)
+    if admin_exists(refresh=True):
         flash('Admin account already exists!', 'warning')
         return redirect(url_for('home'))
 
@@ -211,11 +892,13 @@ def create_admin():
             """, (admin_id, name, email, hashed_password, 'admin'))
             conn.commit()
             conn.close()
+            set_admin_exists(True)
 
             flash('Admin account created successfully!', 'success')
             return redirect(url_for('login'))
 
         except Exception as e:
+            invalidate_admin_exists()
             flash(f'Error creating admin: {str(e)}', 'danger')
             return redirect(url_for('create_admin'))
 
@@ -262,24 +945,445 @@ def logout():
 def admin_dashboard():
     return render_template('admin.html')
 
+# Runtime stats (connection pool etc.) for monitoring
+@app.route('/admin/stats')
+@role_required('admin')
+def admin_stats():
+    return jsonify({
+        'db_pool': get_db_pool().stats(),
+        'qr': qr_stats(),
+        'cards': card_stats(),
+        'reference_data': reference_data_stats(),
+        'previews': preview_stats(),
+        'n8n': n8n_client.stats()
+    })
+
 # 1) Import Student Data page
 from werkzeug.utils import secure_filename
 
+# Columns written to students by the file importer, in COPY/INSERT order
+STUDENT_IMPORT_FIELDS = [
+    'name', 'father_name', 'cnic', 'caste', 'roll_no', 'batch', 'department',
+    'year', 'enrollment', 'emergency_contact', 'relation', 'blood_group', 'address'
+]
+
+REQUIRED_IMPORT_COLUMNS = {'name', 'father_name', 'cnic', 'caste', 'roll_no', 'batch', 'department'}
+
+class ImportValidationError(Exception):
+    """Raised when an import file is rejected; the message is shown to the admin."""
+
+def normalize_import_rows(df):
+    """Stringify and strip the import columns; drop rows without a name or roll number.
+
+    Optional columns missing from the file import as ''. Returns (rows, skipped).
+    """
+    rows = pd.DataFrame({
+        col: df[col].map(lambda v: str(v).strip()) if col in df.columns else ''
+        for col in STUDENT_IMPORT_FIELDS
+    }, index=df.index)
+    keep = (rows['name'] != '') & (rows['roll_no'] != '')
+    return rows[keep].reset_index(drop=True), int((~keep).sum())
+
+def upsert_students_per_row(cur, rows):
+    """Row-at-a-time upsert (SELECT then UPDATE or INSERT). Kept as the benchmark baseline."""
+    inserted, updated = 0, 0
+    update_cols = [c for c in STUDENT_IMPORT_FIELDS if c != 'roll_no']
+    for row in rows.itertuples(index=False):
+        row = row._asdict()
+        cur.execute("SELECT id FROM students WHERE roll_no = %s", (row['roll_no'],))
+        if cur.fetchone():
+            cur.execute(
+                "UPDATE students SET " + ", ".join(f"{c}=%s" for c in update_cols) + " WHERE roll_no=%s",
+                [row[c] for c in update_cols] + [row['roll_no']]
+            )
+            updated += 1
+        else:
+            cur.execute(
+                "INSERT INTO students (" + ", ".join(STUDENT_IMPORT_FIELDS) + ") VALUES ("
+                + ", ".join(["%s"] * len(STUDENT_IMPORT_FIELDS)) + ")",
+                [row[c] for c in STUDENT_IMPORT_FIELDS]
+            )
+            inserted += 1
+    return inserted, updated
+
+def bulk_upsert_students(cur, rows):
+    """COPY rows into a temp staging table and merge them with one INSERT ... ON CONFLICT.
+
+    Returns (inserted, updated). When a roll number appears more than once in
+    the file the last row wins and the earlier ones count as updates, which is
+    what the per-row importer reported. In gevent mode (a wait callback is
+    registered) psycopg2 rejects COPY, so the staging table is filled with
+    multi-row INSERTs instead.
+    """
+    if rows.empty:
+        return 0, 0
+
+    cols = ", ".join(STUDENT_IMPORT_FIELDS)
+    cur.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS student_import_staging (seq INTEGER, "
+        + ", ".join(f"{c} TEXT" for c in STUDENT_IMPORT_FIELDS) + ") ON COMMIT DROP"
+    )
+    cur.execute("TRUNCATE student_import_staging")
+
+    if psycopg2.extensions.get_wait_callback() is not None:
+        execute_values(
+            cur,
+            f"INSERT INTO student_import_staging (seq, {cols}) VALUES %s",
+            rows.itertuples(index=True, name=None),  # the index becomes seq
+            page_size=1000
+        )
+    else:
+        buf = StringIO()
+        rows.to_csv(buf, header=False, index=True)  # the index becomes seq
+        buf.seek(0)
+        cur.copy_expert(
+            f"COPY student_import_staging (seq, {cols}) FROM STDIN "
+            f"WITH (FORMAT csv, FORCE_NOT_NULL ({cols}))",
+            buf
+        )
+
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in STUDENT_IMPORT_FIELDS if c != 'roll_no')
+    cur.execute(f"""
+        WITH latest AS (
+            SELECT DISTINCT ON (roll_no) {cols}
+            FROM student_import_staging
+            ORDER BY roll_no, seq DESC
+        ), merged AS (
+            INSERT INTO students ({cols})
+            SELECT {cols} FROM latest
+            ON CONFLICT (roll_no) DO UPDATE SET {updates}
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted)
+        FROM merged
+    """)
+    inserted, updated = cur.fetchone()
+    duplicates = len(rows) - (inserted + updated)
+    return inserted, updated + duplicates
+
+def _normalize_import_column(name):
+    return str(name).strip().lower().replace(' ', '_')
+
+def _require_import_columns(columns):
+    if not REQUIRED_IMPORT_COLUMNS.issubset(columns):
+        raise ImportValidationError(
+            'File must contain columns: name, father_name, cnic, caste, roll_no, batch, department'
+        )
+
+def iter_import_chunks(file, filename, chunksize):
+    """Yield the upload as DataFrames of at most `chunksize` rows.
+
+    Cells are read as text (empty cells become '') because column types cannot
+    be inferred across chunks. CSV uses pandas' chunked reader; Excel uses a
+    read-only openpyxl row iterator so the workbook is never fully loaded.
+    The header is checked for the required columns before any row is yielded,
+    so a header-only file with wrong columns is still rejected.
+    """
+    if filename.lower().endswith('.csv'):
+        try:
+            reader = pd.read_csv(file, chunksize=chunksize, dtype=str, keep_default_na=False)
+            first = next(reader, None)
+        except pd.errors.EmptyDataError:
+            first = None
+        columns = [] if first is None else [_normalize_import_column(c) for c in first.columns]
+        _require_import_columns(columns)
+        for chunk in itertools.chain([first], reader):
+            chunk.columns = columns
+            yield chunk
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        columns = [] if header is None else [
+            _normalize_import_column(c) if c is not None else '' for c in header
+        ]
+        _require_import_columns(columns)
+        batch = []
+        for row in rows:
+            batch.append(['' if v is None else str(v) for v in row[:len(columns)]])
+            if len(batch) >= chunksize:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+def run_student_import(conn, file, filename, chunksize=None, commit_policy=None, progress=None):
+    """Validate and upsert an import file chunk by chunk.
+
+    Memory stays bounded by `chunksize` rows regardless of the file size.
+    With commit_policy 'file' the whole import is one transaction; with
+    'chunk' every validated chunk is committed as it goes. `progress`, if
+    given, is called with the running totals after each chunk.
+    Raises ImportValidationError for missing columns or unknown
+    batches/departments.
+    """
+    chunksize = chunksize or config.IMPORT_CHUNK_SIZE
+    commit_policy = commit_policy or config.IMPORT_COMMIT_POLICY
+    totals = {'rows': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'chunks': 0}
+    committed_rows = 0
+
+    cur = conn.cursor()
+    try:
+        # Fetch all existing batches and departments once (names)
+        existing_batches = {name.strip().lower() for name in reference_names('batches')}
+        existing_departments = {name.strip().lower() for name in reference_names('departments')}
+
+        for chunk in iter_import_chunks(file, filename, chunksize):
+            # Validation: ensure all batches & departments in this chunk exist
+            chunk_batches = {b.strip().lower() for b in chunk['batch'].unique() if b.strip()}
+            chunk_departments = {d.strip().lower() for d in chunk['department'].unique() if d.strip()}
+            missing_batches = chunk_batches - existing_batches
+            missing_departments = chunk_departments - existing_departments
+
+            if missing_batches or missing_departments:
+                missing_msg = []
+                if missing_batches:
+                    missing_msg.append(f"Missing batches: {', '.join(missing_batches)}")
+                if missing_departments:
+                    missing_msg.append(f"Missing departments: {', '.join(missing_departments)}")
+                if committed_rows:
+                    missing_msg.append(f"{committed_rows} rows from earlier chunks were already saved")
+                raise ImportValidationError("⚠️ Import stopped. " + " | ".join(missing_msg))
+
+            rows, skipped = normalize_import_rows(chunk)
+            inserted, updated = bulk_upsert_students(cur, rows)
+            if commit_policy == 'chunk':
+                invalidate_previews(cur)
+                conn.commit()
+                committed_rows = totals['rows'] + len(chunk)
+
+            totals['rows'] += len(chunk)
+            totals['inserted'] += inserted
+            totals['updated'] += updated
+            totals['skipped'] += skipped
+            totals['chunks'] += 1
+            if progress:
+                progress(dict(totals))
+
+        invalidate_previews(cur)
+        conn.commit()
+        return totals
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+# Background import jobs: uploads are spooled to disk and processed by a small
+# worker pool; progress is persisted in import_jobs so any worker can report it.
+# Jobs only live in the submitting process's executor, so each row records its
+# owner (host:pid:token). A queued/running job whose owner is gone can never
+# finish and is failed by fail_orphaned_import_jobs().
+# Under gevent the "threads" here are greenlets on the hub thread: parsing a
+# chunk with pandas is CPU work that stalls other requests in that worker
+# until the chunk is done, so keep IMPORT_CHUNK_SIZE modest there.
+_import_executor = None
+_import_executor_lock = threading.Lock()
+_IMPORT_OWNER_TOKEN = uuid.uuid4().hex[:8]
+IMPORT_ORPHANED_ERROR = 'Import was interrupted by a server restart. Please upload the file again.'
+
+IMPORT_JOB_FIELDS = [
+    'id', 'filename', 'status', 'rows_processed', 'inserted', 'updated', 'skipped',
+    'errors', 'created_at', 'started_at', 'finished_at'
+]
+
+def get_import_executor():
+    global _import_executor
+    if _import_executor is None:
+        with _import_executor_lock:
+            if _import_executor is None:
+                _import_executor = ThreadPoolExecutor(
+                    max_workers=config.IMPORT_MAX_CONCURRENT,
+                    thread_name_prefix='student-import'
+                )
+                # First use in this process: clean up after earlier ones.
+                try:
+                    fail_orphaned_import_jobs()
+                except psycopg2.Error:
+                    app.logger.exception("Could not recover orphaned import jobs")
+    return _import_executor
+
+def _import_owner():
+    # pid is read per call: forked workers share the module but not the pid
+    return f"{socket.gethostname()}:{os.getpid()}:{_IMPORT_OWNER_TOKEN}"
+
+def _import_owner_alive(owner, idle_seconds):
+    if not owner:
+        return False  # queued before ownership was recorded
+    host, pid, token = owner.rsplit(':', 2)
+    if host != socket.gethostname():
+        # Can't see other hosts' processes; fall back to the progress heartbeat.
+        return idle_seconds < config.IMPORT_JOB_STALE_SECONDS
+    if int(pid) == os.getpid():
+        return token == _IMPORT_OWNER_TOKEN
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def fail_orphaned_import_jobs(job_id=None):
+    """Mark queued/running import jobs whose owning process is gone as failed
+    and drop their spooled uploads. Returns the ids that were failed."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT id, owner, EXTRACT(EPOCH FROM now() - heartbeat_at)
+        FROM import_jobs WHERE status IN ('queued', 'running')
+        {'AND id = %s' if job_id else ''}
+    """, (job_id,) if job_id else None)
+    orphaned = [row[0] for row in cur.fetchall() if not _import_owner_alive(row[1], row[2] or 0)]
+    if orphaned:
+        cur.execute("""
+            UPDATE import_jobs SET status = 'failed', errors = %s, finished_at = now()
+            WHERE id = ANY(%s) AND status IN ('queued', 'running')
+        """, (json.dumps([IMPORT_ORPHANED_ERROR]), orphaned))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    if orphaned and os.path.isdir(config.IMPORT_SPOOL_FOLDER):
+        for name in os.listdir(config.IMPORT_SPOOL_FOLDER):
+            if os.path.splitext(name)[0] in orphaned:
+                try:
+                    os.remove(os.path.join(config.IMPORT_SPOOL_FOLDER, name))
+                except OSError:
+                    pass
+    return orphaned
+
+def _update_import_job(job_id, started=False, finished=False, **fields):
+    assignments = [f"{key} = %s" for key in fields] + ["heartbeat_at = now()"]
+    values = [json.dumps(v) if k == 'errors' else v for k, v in fields.items()]
+    if started:
+        assignments.append("started_at = now()")
+    if finished:
+        assignments.append("finished_at = now()")
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"UPDATE import_jobs SET {', '.join(assignments)} WHERE id = %s", values + [job_id])
+    conn.commit()
+    cur.close()
+    conn.close()
+
+def _run_import_job(job_id, path, filename):
+    _update_import_job(job_id, status='running', started=True)
+
+    def progress(totals):
+        _update_import_job(
+            job_id,
+            rows_processed=totals['rows'],
+            inserted=totals['inserted'],
+            updated=totals['updated'],
+            skipped=totals['skipped']
+        )
+
+    conn = get_db_connection()
+    try:
+        with open(path, 'rb') as fh:
+            result = run_student_import(conn, fh, filename, progress=progress)
+        _update_import_job(
+            job_id,
+            status='completed',
+            rows_processed=result['rows'],
+            inserted=result['inserted'],
+            updated=result['updated'],
+            skipped=result['skipped'],
+            finished=True
+        )
+    except ImportValidationError as e:
+        _update_import_job(job_id, status='failed', errors=[str(e)], finished=True)
+    except Exception as e:
+        app.logger.exception("Import job %s failed", job_id)
+        _update_import_job(job_id, status='failed', errors=[f'Error processing file: {e}'], finished=True)
+    finally:
+        conn.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def submit_import_job(file, filename, admin_user_id=None):
+    """Spool the upload, record a queued job and hand it to the import workers. Returns the job id."""
+    job_id = str(uuid.uuid4())
+    os.makedirs(config.IMPORT_SPOOL_FOLDER, exist_ok=True)
+    path = os.path.join(config.IMPORT_SPOOL_FOLDER, job_id + os.path.splitext(filename)[1].lower())
+    file.save(path)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO import_jobs (id, admin_user_id, filename, owner) VALUES (%s, %s, %s, %s)",
+        (job_id, admin_user_id, filename, _import_owner())
+    )
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    get_import_executor().submit(_run_import_job, job_id, path, filename)
+    return job_id
+
+def get_import_job(job_id, recover=True):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(IMPORT_JOB_FIELDS)} FROM import_jobs WHERE id = %s", (job_id,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    if not row:
+        return None
+    job = dict(zip(IMPORT_JOB_FIELDS, row))
+    # Pollers of a job whose worker died would otherwise wait forever.
+    if recover and job['status'] in ('queued', 'running') and fail_orphaned_import_jobs(job_id):
+        return get_import_job(job_id, recover=False)
+    for key in ('created_at', 'started_at', 'finished_at'):
+        if job[key]:
+            job[key] = job[key].isoformat()
+    return job
+
+@app.cli.command('bench-import')
+@click.option('--rows', default=5000, show_default=True, help='Synthetic rows per run.')
+def bench_import_command(rows):
+    """Compare per-row and set-based import throughput (all work is rolled back)."""
+    df = pd.DataFrame({
+        'name': [f'Bench Student {i}' for i in range(rows)],
+        'father_name': 'Bench Father',
+        'cnic': [f'BENCH-CNIC-{i:07d}' for i in range(rows)],
+        'caste': 'Bench',
+        'roll_no': [f'BENCH-{i:07d}' for i in range(rows)],
+        'batch': 'BENCH', 'department': 'BENCH', 'year': '4', 'enrollment': '',
+        'emergency_contact': '', 'relation': '', 'blood_group': '', 'address': '',
+    })
+    bench_rows, _ = normalize_import_rows(df)
+
+    conn = get_db_connection()
+    try:
+        for label, engine in (('per-row', upsert_students_per_row), ('bulk', bulk_upsert_students)):
+            cur = conn.cursor()
+            for phase in ('insert', 'update'):
+                started = time.perf_counter()
+                inserted, updated = engine(cur, bench_rows)
+                elapsed = time.perf_counter() - started
+                click.echo(f"{label:8} {phase:6} {rows:>7} rows  {elapsed:8.3f}s  "
+                           f"{rows / elapsed:10.0f} rows/s  (inserted={inserted}, updated={updated})")
+            cur.close()
+            conn.rollback()
+    finally:
+        conn.rollback()
+        conn.close()
+
 @app.route('/admin/import', methods=['GET', 'POST'])
 def import_students():
-    conn = get_db_connection()
-    
     if request.method == 'GET':
         # Fetch batches and departments for dropdowns (get names, not IDs)
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM batches")
-        batches = [batch[0] for batch in cur.fetchall()]
-        
-        cur.execute("SELECT name FROM departments")
-        departments = [dept[0] for dept in cur.fetchall()]
-        
-        cur.close()
-        conn.close()
+        batches = reference_names('batches')
+        departments = reference_names('departments')
         
         return render_template('import_students.html', 
                              batches=batches, 
@@ -291,6 +1395,7 @@ def import_students():
         
         if action == 'add_manual':
             # Handle manual student entry
+            conn = get_db_connection()
             try:
                 # Get form data
                 name = request.form.get('name')
@@ -359,153 +1464,436 @@ def import_students():
                 return redirect(request.url)
 
             try:
-                # Read file safely
-                if filename.lower().endswith('.csv'):
-                    df = pd.read_csv(file)
-                else:
-                    df = pd.read_excel(file, engine='openpyxl')
-
-                # Normalize column names
-                df.columns = [c.strip().lower().replace(' ', '_') for c in df.columns]
-
-                # Must have these columns
-                required_cols = {'name', 'father_name', 'cnic', 'caste', 'roll_no', 'batch', 'department'}
-                if not required_cols.issubset(df.columns):
-                    flash('File must contain columns: name, father_name, cnic, caste, roll_no, batch, department', 'danger')
-                    return redirect(request.url)
-
-                # Add any missing optional columns
-                optional_cols = [
-                    'year', 'enrollment', 'emergency_contact', 'relation', 
-                    'blood_group', 'address', 'image_path', 'qr_code'
-                ]
-                for col in optional_cols:
-                    if col not in df.columns:
-                        df[col] = ""
-
-                cur = conn.cursor()
-
-                # Fetch all existing batches and departments once (names)
-                cur.execute("SELECT name FROM batches")
-                existing_batches = {r[0].strip().lower() for r in cur.fetchall()}
-
-                cur.execute("SELECT name FROM departments")
-                existing_departments = {r[0].strip().lower() for r in cur.fetchall()}
-
-                # Collect unique batches/departments from CSV
-                csv_batches = {str(b).strip().lower() for b in df['batch'].dropna().unique()}
-                csv_departments = {str(d).strip().lower() for d in df['department'].dropna().unique()}
-
-                # Validation: ensure all batches & departments exist
-                missing_batches = csv_batches - existing_batches
-                missing_departments = csv_departments - existing_departments
-
-                if missing_batches or missing_departments:
-                    missing_msg = []
-                    if missing_batches:
-                        missing_msg.append(f"Missing batches: {', '.join(missing_batches)}")
-                    if missing_departments:
-                        missing_msg.append(f"Missing departments: {', '.join(missing_departments)}")
-                    flash("⚠️ Import stopped. " + " | ".join(missing_msg), 'danger')
-                    cur.close()
-                    conn.close()
-                    return redirect(request.url)
-
-                inserted, updated = 0, 0
-
-                # Process valid records
-                for _, row in df.iterrows():
-                    name = str(row['name']).strip()
-                    father_name = str(row['father_name']).strip()
-                    cnic = str(row['cnic']).strip()
-                    caste = str(row['caste']).strip()
-                    roll = str(row['roll_no']).strip()
-                    batch_name = str(row['batch']).strip()  # Store name directly
-                    dept_name = str(row['department']).strip()  # Store name directly
-
-                    if not name or not roll:
-                        continue  # skip incomplete rows
-
-                    # Check if student exists
-                    cur.execute("SELECT id FROM students WHERE roll_no = %s", (roll,))
-                    existing_student = cur.fetchone()
-
-                    if existing_student:
-                        # Update existing student
-                        cur.execute("""
-                            UPDATE students SET
-                                name=%s, father_name=%s, cnic=%s, caste=%s,
-                                batch=%s, department=%s, year=%s, enrollment=%s,
-                                emergency_contact=%s, relation=%s, blood_group=%s, address=%s
-                            WHERE roll_no=%s
-                        """, (
-                            name, father_name, cnic, caste,
-                            batch_name, dept_name,  # Using names directly
-                            str(row['year']).strip(),
-                            str(row['enrollment']).strip(),
-                            str(row['emergency_contact']).strip(),
-                            str(row['relation']).strip(),
-                            str(row['blood_group']).strip(),
-                            str(row['address']).strip(),
-                            roll
-                        ))
-                        updated += 1
-                    else:
-                        # Insert new student
-                        cur.execute("""
-                            INSERT INTO students
-                            (name, father_name, cnic, caste, roll_no, batch, department, year, enrollment,
-                             emergency_contact, relation, blood_group, address)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (
-                            name, father_name, cnic, caste, roll, batch_name, dept_name,  # Using names directly
-                            str(row['year']).strip(),
-                            str(row['enrollment']).strip(),
-                            str(row['emergency_contact']).strip(),
-                            str(row['relation']).strip(),
-                            str(row['blood_group']).strip(),
-                            str(row['address']).strip()
-                        ))
-                        inserted += 1
-
-                conn.commit()
-                cur.close()
-                conn.close()
-
-                flash(f'Successfully imported {inserted} new students and updated {updated} existing ones.', 'success')
-                return redirect(url_for('admin_dashboard'))
-
+                job_id = submit_import_job(file, filename, session.get('user_id'))
             except Exception as e:
                 app.logger.exception("Import error")
                 flash('Error processing file: ' + str(e), 'danger')
                 return redirect(request.url)
+
+            status_url = url_for('import_job_status', job_id=job_id)
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({'job_id': job_id, 'status_url': status_url}), 202
+
+            flash(f'Import of {filename} queued. Progress is shown below.', 'info')
+            return redirect(url_for('import_students', job=job_id))
     
     return redirect(request.url)
 
+@app.route('/admin/import/jobs/<job_id>')
+@role_required('admin')
+def import_job_status(job_id):
+    job = get_import_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Import job not found'}), 404
+    return jsonify(job)
+
+# Student photos: every upload is decoded once, EXIF-rotated, stripped of
+# metadata, centre-cropped to the card photo box (132:170) and written as
+# three derivatives side by side. Files are content-addressed,
+# static/uploads/students/<h[:2]>/<h>.<variant>.<ext> with h the sha256 of the
+# upload and the encoding settings, so identical uploads share one set of
+# files and nothing is deleted in place; collect_orphan_files() reclaims
+# files no student references any more.
+# students.image_path stores the card derivative; photo_variant() maps it to
+# the others and leaves legacy single-file paths untouched.
+PHOTO_FOLDER = 'uploads/students'
+PHOTO_ASPECT = 132 / 170
+PHOTO_VARIANTS = {'thumb': (132, 170), 'card': (264, 340), 'print': (528, 680)}
+_PHOTO_VARIANT_RE = re.compile(r'\.(thumb|card|print)\.(webp|jpg)$')
+_CONTENT_ADDRESSED_PHOTO_RE = re.compile(r'^uploads/students/[0-9a-f]{2}/[0-9a-f]{64}\.(thumb|card|print)\.(webp|jpg)$')
+
+
+class PhotoIngestError(ValueError):
+    """Raised when an uploaded photo is rejected; the message is shown to the user."""
+
+
+def photo_encoding():
+    if config.PHOTO_FORMAT.upper() == 'WEBP' and features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+def photo_variant(image_path, variant='card'):
+    if not image_path:
+        return image_path
+    return _PHOTO_VARIANT_RE.sub(rf'.{variant}.\2', image_path.split('static/')[-1])
+
+@app.template_global()
+def photo_url(image_path, variant='card'):
+    return url_for('static', filename=photo_variant(image_path, variant)) if image_path else None
+
+def _crop_to_photo_aspect(img):
+    w, h = img.size
+    if w / h > PHOTO_ASPECT:
+        new_w = round(h * PHOTO_ASPECT)
+        return img.crop(((w - new_w) // 2, 0, (w - new_w) // 2 + new_w, h))
+    new_h = round(w / PHOTO_ASPECT)
+    return img.crop((0, (h - new_h) // 2, w, (h - new_h) // 2 + new_h))
+
+def ingest_student_photo(file):
+    """Normalise an uploaded photo and write its derivatives, unless an
+    identical upload already has them.
+
+    Returns the card derivative's path relative to static/, for students.image_path.
+    """
+    if not file.filename or not allowed_image(file.filename):
+        raise PhotoIngestError('Invalid file type. Only PNG, JPG, JPEG, GIF allowed.')
+    data = file.read(config.PHOTO_MAX_UPLOAD_BYTES + 1)
+    if len(data) > config.PHOTO_MAX_UPLOAD_BYTES:
+        raise PhotoIngestError(f'File size too large. Maximum {config.PHOTO_MAX_UPLOAD_BYTES // (1024 * 1024)}MB allowed.')
+
+    fmt, ext = photo_encoding()
+    digest = hashlib.sha256(json.dumps([fmt, config.PHOTO_QUALITY, PHOTO_VARIANTS], sort_keys=True).encode())
+    digest.update(data)
+    digest = digest.hexdigest()
+    rel_folder = f"{PHOTO_FOLDER}/{digest[:2]}"
+    card_path = f"{rel_folder}/{digest}.card.{ext}"
+    try:
+        # Reuse an identical upload's files. Touching them restarts the GC
+        # grace period: they may be orphans about to be collected, and the
+        # row that references them again is not committed yet.
+        for variant in PHOTO_VARIANTS:
+            os.utime(os.path.join(app.static_folder, photo_variant(card_path, variant)))
+        return card_path
+    except FileNotFoundError:
+        pass  # new upload, or a variant was collected; (re)write them all
+
+    try:
+        img = Image.open(BytesIO(data))
+        img = ImageOps.exif_transpose(img)
+        img.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise PhotoIngestError('Could not read the uploaded image.')
+
+    if img.mode != 'RGB':
+        rgba = img.convert('RGBA')
+        img = Image.new('RGB', rgba.size, 'white')
+        img.paste(rgba, mask=rgba.getchannel('A'))
+    img = _crop_to_photo_aspect(img)
+
+    folder = os.path.join(app.static_folder, rel_folder)
+    os.makedirs(folder, exist_ok=True)
+    for variant, size in sorted(PHOTO_VARIANTS.items(), key=lambda item: -item[1][0]):
+        if img.width > size[0]:
+            img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        img.info.clear()
+        path = os.path.join(folder, f"{digest}.{variant}.{ext}")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        img.save(tmp_path, format=fmt, quality=config.PHOTO_QUALITY, method=4 if fmt == 'WEBP' else 0,
+                 optimize=fmt == 'JPEG')
+        os.replace(tmp_path, path)
+    return card_path
+
+
+# Orphan file GC. Upload and QR folders are scanned against the paths in
+# students.image_path (plus their derivatives) and students.qr_code; files
+# younger than the grace period are kept because an upload is written
+# before the row that references it is committed.
+GC_FOLDERS = (PHOTO_FOLDER, 'uploads/student_images', 'qr_codes')
+GC_REPORT_FILES = 200
+_gc_executor = None
+_gc_executor_lock = threading.Lock()
+_gc_state = {'status': 'idle', 'report': None}
+_gc_state_lock = threading.Lock()
+
+def get_gc_executor():
+    global _gc_executor
+    if _gc_executor is None:
+        with _gc_executor_lock:
+            if _gc_executor is None:
+                _gc_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='file-gc')
+    return _gc_executor
+
+def _static_rel_path(path):
+    return os.path.normpath(path.split('static/')[-1].lstrip('/')).replace(os.sep, '/')
+
+def referenced_static_files():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT image_path, qr_code FROM students WHERE image_path IS NOT NULL OR qr_code IS NOT NULL")
+    referenced = set()
+    for image_path, qr_code in cur:
+        if image_path:
+            referenced.add(_static_rel_path(image_path))
+            referenced.update(_static_rel_path(photo_variant(image_path, v)) for v in PHOTO_VARIANTS)
+        if qr_code:
+            referenced.add(_static_rel_path(qr_code))
+    cur.close()
+    conn.close()
+    return referenced
+
+def collect_orphan_files(dry_run=True, grace_seconds=None):
+    """Delete (or with dry_run, only list) unreferenced files under GC_FOLDERS."""
+    grace_seconds = config.FILE_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = time.time() - grace_seconds
+    referenced = referenced_static_files()
+    report = {'dry_run': dry_run, 'scanned': 0, 'orphans': 0, 'bytes': 0, 'deleted': 0,
+              'skipped_recent': 0, 'files': []}
+
+    for folder in GC_FOLDERS:
+        root = os.path.join(app.static_folder, folder)
+        for dirpath, _dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+                report['scanned'] += 1
+                if rel_path in referenced:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_mtime > cutoff:
+                    report['skipped_recent'] += 1
+                    continue
+                report['orphans'] += 1
+                report['bytes'] += st.st_size
+                if len(report['files']) < GC_REPORT_FILES:
+                    report['files'].append(rel_path)
+                if not dry_run:
+                    try:
+                        os.remove(path)
+                        report['deleted'] += 1
+                    except OSError:
+                        app.logger.warning("Could not remove orphan file %s", path)
+    return report
+
+def _run_file_gc(dry_run, grace_seconds):
+    try:
+        with app.app_context():
+            report = collect_orphan_files(dry_run, grace_seconds)
+        report['finished_at'] = time.time()
+        with _gc_state_lock:
+            _gc_state.update(status='idle', report=report)
+        app.logger.info("File GC%s: %d orphans, %d bytes", ' (dry run)' if dry_run else '',
+                        report['orphans'], report['bytes'])
+    except Exception:
+        app.logger.exception("File GC failed")
+        with _gc_state_lock:
+            _gc_state.update(status='failed')
+
+def submit_file_gc(dry_run=True, grace_seconds=None):
+    """Start a GC run in the background; returns False if one is already running."""
+    with _gc_state_lock:
+        if _gc_state['status'] == 'running':
+            return False
+        _gc_state['status'] = 'running'
+    get_gc_executor().submit(_run_file_gc, dry_run, grace_seconds)
+    return True
+
+@app.route('/admin/files/gc', methods=['GET', 'POST'])
+@role_required('admin')
+def file_gc():
+    """GET: status and last report. POST: start a run (dry_run=1 by default)."""
+    if request.method == 'POST':
+        dry_run = request.values.get('dry_run', '1') not in ('0', 'false', 'no')
+        if not submit_file_gc(dry_run, request.values.get('grace_seconds', type=int)):
+            return jsonify({'error': 'GC already running'}), 409
+        return jsonify({'status': 'running', 'dry_run': dry_run}), 202
+    with _gc_state_lock:
+        return jsonify(dict(_gc_state))
+
+@app.cli.command('gc-files')
+@click.option('--delete', is_flag=True, help='Remove orphans (default is a dry run).')
+@click.option('--grace', type=int, default=None, help='Keep files modified within this many seconds.')
+def gc_files_command(delete, grace):
+    """Report (and with --delete, remove) unreferenced photos and QR images."""
+    report = collect_orphan_files(dry_run=not delete, grace_seconds=grace)
+    for rel_path in report['files']:
+        click.echo(rel_path)
+    click.echo(f"scanned={report['scanned']} orphans={report['orphans']} bytes={report['bytes']} "
+               f"deleted={report['deleted']} skipped_recent={report['skipped_recent']}"
+               + (" (dry run)" if not delete else ""))
+
+# Static asset pipeline. Files under static/ (except the upload and QR
+# folders) are copied to ASSET_BUILD_FOLDER under content-hash names,
+# e.g. uni_garden.png -> uni_garden.1a2b3c4d.webp. Large images are
+# re-encoded (WEBP, alpha kept) and get resized width variants, and text
+# assets get a .gz twin. url_for('static', filename=...) resolves to the
+# fingerprinted name through the url_defaults hook below, and those names
+# are served with a one-year immutable Cache-Control.
+ASSET_DYNAMIC_FOLDERS = ('uploads', 'qr_codes')
+ASSET_IMAGE_EXT = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+ASSET_GZIP_EXT = {'.js', '.css', '.svg', '.json', '.txt'}
+ASSET_MANIFEST = 'manifest.json'
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+_asset_manifest = {'files': {}, 'served': set(), 'gzip': set(), 'loaded': False}
+_asset_lock = threading.Lock()
+
+def _asset_build_dir():
+    return os.path.join(app.root_path, config.ASSET_BUILD_FOLDER)
+
+def _asset_sources():
+    sources = {}
+    for dirpath, dirnames, filenames in os.walk(app.static_folder):
+        rel_dir = os.path.relpath(dirpath, app.static_folder)
+        if rel_dir.split(os.sep)[0] in ASSET_DYNAMIC_FOLDERS:
+            dirnames[:] = []
+            continue
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            st = os.stat(path)
+            sources[os.path.relpath(path, app.static_folder).replace(os.sep, '/')] = [st.st_mtime_ns, st.st_size]
+    return sources
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _write_asset(rel_source, data, ext, suffix=''):
+    stem = os.path.splitext(rel_source)[0]
+    name = f"{stem}{suffix}.{hashlib.sha256(data).hexdigest()[:8]}{ext}"
+    path = os.path.join(_asset_build_dir(), name)
+    if not os.path.exists(path):
+        _atomic_write(path, data)
+    return name
+
+def _build_image_asset(rel_source, data):
+    """Returns {'default': name, 'widths': {width: name}} for a large image."""
+    img = Image.open(BytesIO(data))
+    img.load()
+    has_alpha = img.mode in ('RGBA', 'LA') or 'transparency' in img.info
+    img = img.convert('RGBA' if has_alpha else 'RGB')
+    fmt, ext = photo_encoding()
+    if fmt == 'JPEG' and has_alpha:
+        fmt, ext = 'PNG', 'png'
+
+    def encode(im):
+        buf = BytesIO()
+        im.save(buf, format=fmt, quality=80, method=4 if fmt == 'WEBP' else 0, optimize=True)
+        return buf.getvalue()
+
+    largest = max(config.ASSET_IMAGE_WIDTHS)
+    if img.width > largest:
+        img = img.resize((largest, round(img.height * largest / img.width)), Image.LANCZOS)
+    entry = {'default': _write_asset(rel_source, encode(img), '.' + ext), 'widths': {}}
+    for width in sorted(config.ASSET_IMAGE_WIDTHS):
+        if width < img.width:
+            resized = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+            entry['widths'][str(width)] = _write_asset(rel_source, encode(resized), '.' + ext, f'.w{width}')
+    return entry
+
+def build_assets(force=False):
+    """Build fingerprinted copies of static/ into ASSET_BUILD_FOLDER.
+
+    Skips the work when the manifest was built from the same source files.
+    Returns the manifest.
+    """
+    build_dir = _asset_build_dir()
+    manifest_path = os.path.join(build_dir, ASSET_MANIFEST)
+    sources = _asset_sources()
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('sources') == sources:
+            return manifest
+
+    manifest = {'sources': sources, 'files': {}, 'gzip': []}
+    for rel_source in sorted(sources):
+        with open(os.path.join(app.static_folder, rel_source), 'rb') as f:
+            data = f.read()
+        ext = os.path.splitext(rel_source)[1].lower()
+        if ext in ASSET_IMAGE_EXT and len(data) >= config.ASSET_REENCODE_MIN_BYTES:
+            try:
+                manifest['files'][rel_source] = _build_image_asset(rel_source, data)
+                continue
+            except (OSError, ValueError):
+                app.logger.warning("Could not re-encode %s; copying it as is", rel_source)
+        name = _write_asset(rel_source, data, ext)
+        manifest['files'][rel_source] = {'default': name, 'widths': {}}
+        if ext in ASSET_GZIP_EXT:
+            gz_path = os.path.join(build_dir, name + '.gz')
+            if not os.path.exists(gz_path):
+                _atomic_write(gz_path, gzip.compress(data, 9, mtime=0))
+            manifest['gzip'].append(name)
+
+    _atomic_write(manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return manifest
+
+def load_asset_manifest(manifest=None):
+    if manifest is None:
+        if config.ASSET_BUILD_ON_STARTUP:
+            manifest = build_assets()
+        else:
+            try:
+                with open(os.path.join(_asset_build_dir(), ASSET_MANIFEST)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {'files': {}, 'gzip': []}
+    served = {entry['default'] for entry in manifest['files'].values()}
+    served.update(name for entry in manifest['files'].values() for name in entry['widths'].values())
+    with _asset_lock:
+        _asset_manifest.update(files=manifest['files'], served=served, gzip=set(manifest['gzip']), loaded=True)
+
+def _ensure_asset_manifest():
+    # Concurrent first requests may both build; outputs are content-named
+    # and written atomically, so that is only duplicated work.
+    if _asset_manifest['loaded']:
+        return
+    try:
+        load_asset_manifest()
+    except (OSError, ValueError):
+        app.logger.exception("Asset build failed; serving static files unfingerprinted")
+        with _asset_lock:
+            _asset_manifest['loaded'] = True
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    """url_for('static', filename=..., width=...) -> fingerprinted name."""
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    _ensure_asset_manifest()
+    width = values.pop('width', None)
+    entry = _asset_manifest['files'].get(values['filename'])
+    if entry:
+        widths = {int(w): name for w, name in entry['widths'].items()}
+        fits = [w for w in widths if width and w >= int(width)]
+        values['filename'] = widths[min(fits)] if fits else entry['default']
+
+def serve_static(filename):
+    """Static view: fingerprinted builds and content-addressed photos are
+    immutable; everything else is served as before."""
+    _ensure_asset_manifest()
+    if filename in _asset_manifest['served']:
+        precompressed = filename in _asset_manifest['gzip']
+        if precompressed and 'gzip' in request.accept_encodings:
+            response = send_from_directory(_asset_build_dir(), filename + '.gz',
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(_asset_build_dir(), filename)
+        if precompressed:
+            response.vary.add('Accept-Encoding')
+    else:
+        response = app.send_static_file(filename)
+        if not _CONTENT_ADDRESSED_PHOTO_RE.search(filename):
+            return response
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = serve_static
+
+@app.cli.command('build-assets')
+@click.option('--force', is_flag=True, help='Rebuild even if the sources are unchanged.')
+def build_assets_command(force):
+    """Build fingerprinted, pre-compressed static assets."""
+    manifest = build_assets(force=force)
+    for source, entry in sorted(manifest['files'].items()):
+        click.echo(f"{source} -> {entry['default']}" + (f" (+{len(entry['widths'])} widths)" if entry['widths'] else ''))
+
+
 @app.route('/student/register', methods=['GET', 'POST'])
 def student_register():
-    conn = get_db_connection()
-    
-    # Configure upload settings
-    UPLOAD_FOLDER = 'static/uploads/students'
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    MAX_FILE_SIZE = 2 * 1024 * 1024  # 2MB
-    
-    def allowed_file(filename):
-        return '.' in filename and \
-               filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-    
     if request.method == 'GET':
         # Fetch batches and departments for dropdowns
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM batches")
-        batches = [batch[0] for batch in cur.fetchall()]
-        
-        cur.execute("SELECT name FROM departments")
-        departments = [dept[0] for dept in cur.fetchall()]
-        
-        cur.close()
-        conn.close()
+        batches = reference_names('batches')
+        departments = reference_names('departments')
         
         return render_template('student_register.html', 
                              batches=batches, 
@@ -513,6 +1901,7 @@ def student_register():
     
     # POST request handling
     if request.method == 'POST':
+        conn = get_db_connection()
         try:
             # Get form data
             name = request.form.get('name')
@@ -549,30 +1938,10 @@ def student_register():
             if 'student_image' in request.files:
                 file = request.files['student_image']
                 if file and file.filename != '' and file.filename != 'undefined':
-                    if file.content_length > MAX_FILE_SIZE:
-                        flash('File size too large. Maximum 2MB allowed.', 'danger')
-                        cur.close()
-                        conn.close()
-                        return redirect(request.url)
-                    
-                    if allowed_file(file.filename):
-                        # Create upload directory if it doesn't exist
-                        if not os.path.exists(UPLOAD_FOLDER):
-                            os.makedirs(UPLOAD_FOLDER)
-                        
-                        # Generate secure filename
-                        file_ext = file.filename.rsplit('.', 1)[1].lower()
-                        filename = f"{roll_no}_{name.replace(' ', '_')}_{int(time.time())}.{file_ext}"
-                        filename = secure_filename(filename)
-                        
-                        # Save file
-                        file_path = os.path.join(UPLOAD_FOLDER, filename)
-                        file.save(file_path)
-                        
-                        # Store relative path for web display
-                        image_path = f"uploads/students/{filename}"
-                    else:
-                        flash('Invalid file type. Only PNG, JPG, JPEG, GIF allowed.', 'danger')
+                    try:
+                        image_path = ingest_student_photo(file)
+                    except PhotoIngestError as e:
+                        flash(str(e), 'danger')
                         cur.close()
                         conn.close()
                         return redirect(request.url)
@@ -613,22 +1982,16 @@ def upload_image(student_id):
     file = request.files.get('image')
     if not file:
         return jsonify({'status': 'error', 'message': 'No file provided'}), 400
-    if not allowed_image(file.filename):
-        return jsonify({'status': 'error', 'message': 'Unsupported image type'}), 400
-
-    filename = secure_filename(f"{student_id}_{file.filename}")
-    upload_folder = os.path.join('static', 'uploads', 'student_images')
-    os.makedirs(upload_folder, exist_ok=True)
-
-    dest = os.path.join(upload_folder, filename)
-    file.save(dest)
-
-    # ✅ Store relative path (WITHOUT static/)
-    rel_path = os.path.join('uploads', 'student_images', filename)
+    try:
+        # ✅ Stored relative path (WITHOUT static/)
+        rel_path = ingest_student_photo(file)
+    except PhotoIngestError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("UPDATE students SET image_path=%s WHERE id=%s", (rel_path, student_id))
+    invalidate_previews(cur, [student_id])
     conn.commit()
     cur.close()
     conn.close()
@@ -636,80 +1999,370 @@ def upload_image(student_id):
     # ✅ Return correct static URL for live preview
     return jsonify({
         'status': 'ok',
-        'image_path': url_for('static', filename=rel_path)
+        'image_path': photo_url(rel_path),
+        'thumb_url': photo_url(rel_path, 'thumb')
     }), 200 
 
+class LRUCache:
+    """Thread-safe LRU mapping bounded by entry count, with hit/miss counters.
+
+    With `maxbytes`, entries are also evicted once the sizes passed to put()
+    add up to more than that.
+    """
+
+    def __init__(self, maxsize, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, size=0):
+        with self._lock:
+            self._bytes += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize or (self.maxbytes and self._bytes > self.maxbytes):
+                old_key, _ = self._data.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._sizes.pop(key)
+                return self._data.pop(key)
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {'entries': len(self._data), 'max_entries': self.maxsize,
+                     'hits': self.hits, 'misses': self.misses}
+            if self.maxbytes:
+                stats.update(bytes=self._bytes, max_bytes=self.maxbytes)
+            return stats
+
+
+# QR codes: the payload text plus the QR parameters are hashed and stored in
+# students.qr_hash, so an image is only re-rendered when either changes.
+QR_PARAMS = {'version': 3, 'error_correction': 'M', 'box_size': 8, 'border': 2}
+
+_qr_stats = {'hits': 0, 'regenerations': 0}
+_qr_stats_lock = threading.Lock()
+
+def record_qr_stat(key, count=1):
+    with _qr_stats_lock:
+        _qr_stats[key] += count
+
+def qr_stats():
+    with _qr_stats_lock:
+        stats = dict(_qr_stats)
+    stats['cache'] = qr_image_cache.stats()
+    return stats
+
+def build_qr_payload(name, roll_no, department, degree, batch, year, father_name):
+    return f"""STUDENT ID CARD
+Benazir Bhutto Shaheed University
+
+Name: {name}
+Roll No: {roll_no}
+Department: {department}
+Degree: {degree or 'N/A'}
+Batch: {batch}
+Year: {year}
+Father Name: {father_name}
+
+If found, please return to university."""
+
+def qr_payload_hash(payload, params=None):
+    params = params or QR_PARAMS
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8'))
+    digest.update(payload.encode('utf-8'))
+    return digest.hexdigest()
+
+def render_qr_image(payload, params=None):
+    params = params or QR_PARAMS
+    qr = qrcode.QRCode(
+        version=params['version'],
+        error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{params['error_correction']}"),
+        box_size=params['box_size'],
+        border=params['border']
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.make_image(fill_color="black", back_color="white")
+
+def _render_qr_chunk(chunk, params):
+    """Process-pool task: render and save a list of (payload, path) pairs."""
+    for payload, path in chunk:
+        render_qr_image(payload, params).save(path)
+    return len(chunk)
+
+_qr_executor = None
+_qr_executor_lock = threading.Lock()
+
+def get_qr_executor():
+    global _qr_executor
+    if _qr_executor is None:
+        with _qr_executor_lock:
+            if _qr_executor is None:
+                # spawn, not fork: forking a threaded server can copy held locks
+                _qr_executor = ProcessPoolExecutor(
+                    max_workers=config.QR_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _qr_executor
+
+def render_qr_batch(jobs, params=None, parallel=None):
+    """Render and save QR images for a list of (payload, path) pairs.
+
+    Batches of at least QR_PARALLEL_THRESHOLD are spread over the process
+    pool in chunks big enough to amortize pickling; smaller ones render
+    inline. Returns once every file is written.
+    """
+    params = params or QR_PARAMS
+    if parallel is None:
+        parallel = config.QR_WORKERS > 1 and len(jobs) >= config.QR_PARALLEL_THRESHOLD
+    if not parallel:
+        return _render_qr_chunk(jobs, params)
+
+    global _qr_executor
+    chunk_size = config.QR_CHUNK_SIZE or max(16, -(-len(jobs) // (config.QR_WORKERS * 4)))
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    try:
+        return sum(get_qr_executor().map(_render_qr_chunk, chunks, [params] * len(chunks)))
+    except BrokenProcessPool:
+        app.logger.exception("QR worker pool died; rendering inline")
+        with _qr_executor_lock:
+            _qr_executor = None
+        return _render_qr_chunk(jobs, params)
+
+@app.cli.command('bench-qr')
+@click.option('--sizes', default='100,1000,10000', show_default=True, help='Comma-separated batch sizes.')
+def bench_qr_command(sizes):
+    """Compare serial and process-pool QR rendering for synthetic students."""
+    import tempfile
+    get_qr_executor().submit(int).result()  # start the workers outside the timed runs
+    for size in [int(n) for n in sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs = [
+                (build_qr_payload(f'Bench Student {i}', f'BENCH-{i:07d}', 'Bench', 'Bench Degree', '2024', '4', 'Bench Father'),
+                 os.path.join(tmp, f'qr_{i}.png'))
+                for i in range(size)
+            ]
+            timings = {}
+            for label, parallel in (('serial', False), ('parallel', True)):
+                started = time.perf_counter()
+                render_qr_batch(jobs, parallel=parallel)
+                timings[label] = time.perf_counter() - started
+            click.echo(f"{size:>7} students  serial {timings['serial']:8.3f}s  "
+                       f"parallel {timings['parallel']:8.3f}s ({config.QR_WORKERS} workers)  "
+                       f"speedup {timings['serial'] / timings['parallel']:5.2f}x")
+
+qr_image_cache = LRUCache(config.QR_CACHE_SIZE)
+
+# On-demand QR image. The payload hash (which covers the QR parameters) is the
+# strong ETag and the LRU key, so unchanged students revalidate with a 304.
+@app.route('/admin/qr/<int:student_id>.png')
+@role_required('admin')
+def qr_image(student_id):
+    params = QR_PARAMS
+    box_size = request.args.get('box_size', type=int)
+    if box_size:
+        params = dict(QR_PARAMS, box_size=max(1, min(box_size, 20)))
+
+    s = load_card_data(student_id)
+    if not s:
+        abort(404)
+
+    payload = build_qr_payload(s['name'], s['roll_no'], s['department'], s['department_degree'],
+                               s['batch'], s['year'], s['father_name'])
+    payload_hash = qr_payload_hash(payload, params)
+
+    response = make_response()
+    response.set_etag(payload_hash)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if request.if_none_match.contains(payload_hash):
+        response.status_code = 304
+        return response
+
+    png = qr_image_cache.get(payload_hash)
+    if png is None:
+        buf = BytesIO()
+        render_qr_image(payload, params).save(buf, format='PNG')
+        png = buf.getvalue()
+        qr_image_cache.put(payload_hash, png)
+        record_qr_stat('regenerations')
+    else:
+        record_qr_stat('hits')
+
+    response.set_data(png)
+    response.mimetype = 'image/png'
+    return response
+
 # 2) Generate Student ID - filter and list students
+#
+# The listing is keyset-paginated on (name, id): `after` is an opaque token
+# for the last row of the previous page, so every page is an index range
+# scan of GENERATE_PAGE_SIZE rows however large the table is.
+STUDENT_LIST_FILTERS = ('batch', 'department', 'roll_no', 'year', 'has_photo', 'has_qr')
+
+def encode_page_cursor(name, student_id):
+    return base64.urlsafe_b64encode(json.dumps([name, student_id]).encode()).decode().rstrip('=')
+
+def decode_page_cursor(token):
+    try:
+        name, student_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return str(name), int(student_id)
+    except (ValueError, TypeError):
+        abort(400)
+
+def _like_prefix(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def request_student_filters():
+    """The STUDENT_LIST_FILTERS values of the current request ('' when absent)."""
+    return {key: request.values.get(key, '').strip() for key in STUDENT_LIST_FILTERS}
+
+def student_filter_clauses(filters):
+    """WHERE clauses and params on student_cards `s` for STUDENT_LIST_FILTERS.
+
+    Shared by the listing, print sheets and ZIP export so all three select the
+    same students for the same form.
+    """
+    clauses, params = [], []
+    if filters.get('batch'):
+        clauses.append("s.batch = %s")
+        params.append(filters['batch'])
+    if filters.get('department'):
+        clauses.append("s.department = %s")
+        params.append(filters['department'])
+    if filters.get('roll_no'):
+        clauses.append("s.roll_no LIKE %s")
+        params.append(_like_prefix(filters['roll_no']))
+    if filters.get('year'):
+        clauses.append("s.year = %s")
+        params.append(filters['year'])
+    for key, column in (('has_photo', 's.image_path'), ('has_qr', 's.qr_code')):
+        if filters.get(key) == '1':
+            clauses.append(f"COALESCE({column}, '') <> ''")
+        elif filters.get(key) == '0':
+            clauses.append(f"COALESCE({column}, '') = ''")
+    return clauses, params
+
+def fetch_student_page(cur, filters, after=None, limit=None):
+    """Return (rows, next_cursor) for one page of the generate_id listing."""
+    limit = limit or config.GENERATE_PAGE_SIZE
+    clauses, params = student_filter_clauses(filters)
+    if after:
+        clauses.append("(s.name, s.id) > (%s, %s)")
+        params.extend(after)
+
+    cur.execute(f"""
+        SELECT s.id, s.name, s.father_name, s.roll_no, s.department, s.batch, s.year, s.image_path, s.qr_code,
+               s.department_degree, s.qr_hash
+        FROM student_cards s
+        {"WHERE " + " AND ".join(clauses) if clauses else ""}
+        ORDER BY s.name, s.id
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_page_cursor(rows[-1][1], rows[-1][0])
+    return rows, None
+
 @app.route('/admin/generate', methods=['GET', 'POST'])
 @role_required('admin')
 def generate_id():
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # Fetch batches and departments
-    cur.execute("SELECT name FROM batches ORDER BY name")
-    batches = [r[0] for r in cur.fetchall()]
-
-    cur.execute("SELECT name FROM departments ORDER BY name")
-    departments = [r[0] for r in cur.fetchall()]
+    filters = request_student_filters()
+    filtered = request.method == 'POST' or any(key in request.args for key in STUDENT_LIST_FILTERS + ('after',))
+    wants_json = request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
 
     students = []
+    next_url = None
 
-    if request.method == 'POST':
-        batch = request.form.get('batch', '')
-        department = request.form.get('department', '')
-
-        query = """
-            SELECT s.id, s.name, s.father_name, s.roll_no, s.department, s.batch, s.year, s.image_path, s.qr_code, d.degree
-            FROM students s
-            LEFT JOIN departments d ON LOWER(s.department) = LOWER(d.name)
-            WHERE (%s = '' OR s.batch = %s)
-              AND (%s = '' OR s.department = %s)
-            ORDER BY s.name
-        """
-        cur.execute(query, (batch, batch, department, department))
-        students = cur.fetchall()
+    if filtered:
+        after = request.args.get('after')
+        students, next_cursor = fetch_student_page(cur, filters, decode_page_cursor(after) if after else None)
+        if next_cursor:
+            next_url = url_for('generate_id', after=next_cursor, **{k: v for k, v in filters.items() if v})
 
+    # QR images are served on demand by qr_image(); writing them to
+    # static/qr_codes while listing is only done when explicitly enabled.
+    if students and config.QR_EAGER_GENERATION:
         qr_folder = os.path.join(current_app.root_path, 'static', 'qr_codes')
         os.makedirs(qr_folder, exist_ok=True)
 
+        pending = []
+        qr_updates = []
         for student in students:
-            student_id, name, father_name, roll_no, dept_name, batch, year, image_path, qr_code, degree = student
+            student_id, name, father_name, roll_no, dept_name, batch, year, image_path, qr_code, degree, qr_hash = student
 
-            qr_text = f"""STUDENT ID CARD
-Benazir Bhutto Shaheed University
-
-Name: {name}
-Roll No: {roll_no}
-Department: {dept_name}
-Degree: {degree or 'N/A'}
-Batch: {batch}
-Year: {year}
-Father Name: {father_name}
-
-If found, please return to university."""
-
-            qr = qrcode.QRCode(
-                version=3,
-                error_correction=qrcode.constants.ERROR_CORRECT_M,
-                box_size=8,
-                border=2
-            )
-            qr.add_data(qr_text)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
+            qr_text = build_qr_payload(name, roll_no, dept_name, degree, batch, year, father_name)
+            payload_hash = qr_payload_hash(qr_text)
 
             qr_filename = f"qr_{student_id}.png"
             qr_path = os.path.join(qr_folder, qr_filename)
-            img.save(qr_path)
-
             qr_relative_path = f"qr_codes/{qr_filename}"
-            cur.execute(
-                "UPDATE students SET qr_code = %s WHERE id = %s",
-                (qr_relative_path, student_id)
-            )
+
+            # Skip students whose QR payload and parameters are unchanged
+            if qr_hash == payload_hash and qr_code == qr_relative_path and os.path.exists(qr_path):
+                record_qr_stat('hits')
+                continue
+            pending.append((qr_text, qr_path))
+            if (qr_code, qr_hash) != (qr_relative_path, payload_hash):
+                qr_updates.append((student_id, qr_relative_path, payload_hash))
+
+        if pending:
+            render_qr_batch(pending)
+            record_qr_stat('regenerations', len(pending))
+
+        # Write all changed paths back in one statement and one commit
+        if qr_updates:
+            execute_values(cur, """
+                UPDATE students AS s
+                SET qr_code = v.qr_code, qr_hash = v.qr_hash
+                FROM (VALUES %s) AS v(id, qr_code, qr_hash)
+                WHERE s.id = v.id
+                  AND (s.qr_code IS DISTINCT FROM v.qr_code OR s.qr_hash IS DISTINCT FROM v.qr_hash)
+            """, qr_updates, page_size=1000)
             conn.commit()
 
+    if wants_json:
+        cur.close()
+        conn.close()
+        return jsonify({
+            'html': render_template('student_rows.html', students=students),
+            'count': len(students),
+            'next_url': next_url
+        })
+
+    # Fetch batches and departments
+    batches = reference_names('batches')
+    departments = reference_names('departments')
+
     cur.close()
     conn.close()
 
@@ -717,96 +2370,802 @@ If found, please return to university."""
         'generate_id.html',
         batches=batches,
         departments=departments,
-        students=students
+        students=students,
+        filters=filters,
+        filtered=filtered,
+        next_url=next_url
     )
 
 
+# Rendered id_preview fragments, keyed by student id and tagged with the
+# student_cards version they were rendered from. A cached fragment is served,
+# or answered with 304 for a matching ETag, without touching Postgres. Every
+# update or delete of student_cards sends NOTIFY preview_cache with the ids
+# (migration 6), so every worker drops them once the change commits, whoever
+# made it. Write paths also call invalidate_previews() to drop this worker's
+# entries right away.
+PREVIEW_CHANNEL = 'preview_cache'
+PREVIEW_NOTIFY_MAX_PAYLOAD = 7000  # NOTIFY payloads are limited to 8000 bytes
+
+preview_cache = LRUCache(config.PREVIEW_CACHE_SIZE, maxbytes=config.PREVIEW_CACHE_MAX_BYTES)
+_preview_state = {'generation': 0, 'not_modified': 0, 'invalidations': 0}
+_preview_lock = threading.Lock()
+
+def _drop_previews(student_ids=None):
+    with _preview_lock:
+        _preview_state['generation'] += 1
+        _preview_state['invalidations'] += 1
+    if student_ids is None:
+        preview_cache.clear()
+    else:
+        for student_id in student_ids:
+            preview_cache.pop(student_id)
+
+def _handle_preview_notify(payload):
+    if payload is None or payload == '*':
+        _drop_previews()
+    else:
+        _drop_previews([int(i) for i in payload.split(',') if i.isdigit()])
+
+NOTIFY_HANDLERS[PREVIEW_CHANNEL] = _handle_preview_notify
+
+def invalidate_previews(cur, student_ids=None):
+    """Drop cached previews for `student_ids` (all if None) in this process
+    now, and in every other worker once `cur`'s transaction commits."""
+    ids = None if student_ids is None else [int(i) for i in student_ids]
+    _drop_previews(ids)
+    payload = '*' if ids is None else ','.join(map(str, ids))
+    if len(payload) > PREVIEW_NOTIFY_MAX_PAYLOAD:
+        payload = '*'
+    cur.execute("SELECT pg_notify(%s, %s)", (PREVIEW_CHANNEL, payload))
+
+def preview_stats():
+    stats = preview_cache.stats()
+    with _preview_lock:
+        stats['not_modified'] = _preview_state['not_modified']
+        stats['invalidations'] = _preview_state['invalidations']
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
 # Serve a printable HTML for a student's ID (used by JS to render modal & download)
 @app.route('/admin/id_preview/<int:student_id>')
 @role_required('admin')
 def id_preview(student_id):
+    use_cache = change_listener_ready()
+    cached = preview_cache.get(student_id) if use_cache else None
+
+    if cached is None:
+        generation = _preview_state['generation']
+        student = load_card_data(student_id)
+        if not student:
+            abort(404)
+
+        html = render_template('id_modal.html', student=student).encode()
+        cached = (f"{student['version']}-{hashlib.sha256(html).hexdigest()[:16]}", html)
+        if use_cache:
+            with _preview_lock:
+                # don't store a fragment an invalidation raced with
+                if _preview_state['generation'] == generation:
+                    preview_cache.put(student_id, cached, len(html))
+
+    etag, html = cached
+    response = make_response(html)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if request.if_none_match.contains(etag):
+        with _preview_lock:
+            _preview_state['not_modified'] += 1
+        response.status_code = 304
+        response.set_data(b'')
+    return response
+
+@app.route('/admin/id_card/<int:student_id>')
+@role_required('admin')
+def generate_id_modal(student_id):
+    student_dict = load_card_data(student_id)
+    if not student_dict:
+        flash("Student not found", "danger")
+        return redirect(url_for('admin_dashboard'))
+
+    if student_dict['image_path'] and student_dict['image_path'].startswith('static/'):
+        student_dict['image_path'] = student_dict['image_path'].replace('static/', '')
+
+    return render_template('id_modal.html', student=student_dict)
+
+
+# Server-side ID card rendering (Pillow). The layout mirrors id_modal.html in
+# CSS pixels (a 360x560 card) and is scaled so the card is CR80 width
+# (2.125in) at the requested DPI.
+CARD_WIDTH, CARD_HEIGHT = 360, 560
+CARD_WIDTH_INCHES = 2.125
+
+CARD_BROWN = '#592b1b'
+CARD_GOLD = '#d9a627'
+CARD_CREAM = '#fff7e6'
+CARD_INK = '#2d3748'
+CARD_MUTED = '#4a5568'
+
+CARD_UNIVERSITY_NAME = (
+    "The Benazir Bhutto Shaheed University of Technology",
+    "and Skill Development",
+    "Khairpur Mirs",
+)
+CARD_RETURN_ADDRESS = (
+    "If found please return to the Benazir Bhutto Shaheed University of Technology "
+    "and Skill Development Khairpur Mir's Sindh (66020)"
+)
+CARD_CONTACT_LINES = (
+    "www.bbsutsd.edu.pk | Contact : 0243-687059",
+    "Email: director-admission@bbsutsd.edu.pk",
+)
+CARD_VALID_UNTIL = '31st December 2026'
+CARD_BACK_FIELDS = [
+    ("Father's Name", 'father_name'),
+    ('Caste', 'caste'),
+    ('CNIC/B.Form', 'cnic'),
+    ('Enrollment #', 'enrollment'),
+    ('Emergency #', 'emergency_contact'),
+    ('Relation', 'relation'),
+    ('Blood Group', 'blood_group'),
+    ('Address', 'address'),
+]
+
+def card_scale(dpi):
+    return CARD_WIDTH_INCHES * dpi / CARD_WIDTH
+
+def card_pixel_size(dpi):
+    scale = card_scale(dpi)
+    return round(CARD_WIDTH * scale), round(CARD_HEIGHT * scale)
+
+# Everything that does not depend on the student (bands, logo, labels, the
+# photo/QR frames and the rounded-corner mask) is drawn once per side and DPI
+# and cached; a card is a copy of that base plus the per-student fields. The
+# cache and the loaded fonts are dropped when a template asset changes on disk.
+CARD_TEMPLATE_ASSETS = ('uni_logo.png',)
+
+card_layer_cache = LRUCache(config.CARD_LAYER_CACHE_SIZE)
+_card_fonts = {}
+_card_fonts_lock = threading.Lock()
+_card_template = {'signature': None, 'checked_at': 0.0}
+_card_template_lock = threading.Lock()
+
+_card_stats = {'renders': 0, 'render_ms_total': 0.0, 'render_ms_max': 0.0, 'invalidations': 0}
+_card_stats_lock = threading.Lock()
+
+def record_card_render(elapsed_ms):
+    with _card_stats_lock:
+        _card_stats['renders'] += 1
+        _card_stats['render_ms_total'] += elapsed_ms
+        _card_stats['render_ms_max'] = max(_card_stats['render_ms_max'], elapsed_ms)
+
+def card_stats():
+    with _card_stats_lock:
+        stats = dict(_card_stats)
+    stats['render_ms_avg'] = stats['render_ms_total'] / stats['renders'] if stats['renders'] else 0.0
+    stats['layers'] = card_layer_cache.stats()
+    return stats
+
+def card_template_signature():
+    paths = [os.path.join(app.static_folder, name) for name in CARD_TEMPLATE_ASSETS]
+    paths += [config.CARD_FONT_REGULAR, config.CARD_FONT_BOLD]
+    signature = []
+    for path in paths:
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def check_card_template():
+    """Invalidate cached layers and fonts if a template asset has changed."""
+    now = time.monotonic()
+    with _card_template_lock:
+        if now - _card_template['checked_at'] < config.CARD_TEMPLATE_CHECK_INTERVAL:
+            return
+        _card_template['checked_at'] = now
+        signature = card_template_signature()
+        if signature == _card_template['signature']:
+            return
+        if _card_template['signature'] is not None:
+            card_layer_cache.clear()
+            with _card_fonts_lock:
+                _card_fonts.clear()
+            with _card_stats_lock:
+                _card_stats['invalidations'] += 1
+        _card_template['signature'] = signature
+
+def load_card_font(size_px, bold=False):
+    key = (size_px, bold)
+    with _card_fonts_lock:
+        font = _card_fonts.get(key)
+    if font is None:
+        path = config.CARD_FONT_BOLD if bold else config.CARD_FONT_REGULAR
+        try:
+            font = ImageFont.truetype(path, size_px)
+        except OSError:
+            font = ImageFont.load_default(size=size_px)
+        with _card_fonts_lock:
+            _card_fonts[key] = font
+    return font
+
+
+class CardCanvas:
+    """Draws on a card image using id_modal.html's CSS pixel coordinates."""
+
+    def __init__(self, dpi, image=None):
+        self.scale = card_scale(dpi)
+        self.image = image or Image.new('RGB', card_pixel_size(dpi), 'white')
+        self.draw = ImageDraw.Draw(self.image)
+
+    def px(self, value):
+        return round(value * self.scale)
+
+    def font(self, size, bold=False):
+        return load_card_font(self.px(size), bold)
+
+    def rect(self, box, fill=None, radius=0, outline=None, width=0):
+        box = [self.px(v) for v in box]
+        if radius:
+            self.draw.rounded_rectangle(box, radius=self.px(radius), fill=fill,
+                                        outline=outline, width=self.px(width))
+        else:
+            self.draw.rectangle(box, fill=fill, outline=outline, width=self.px(width))
+
+    def text_width(self, text, size, bold=False):
+        return self.draw.textlength(text, font=self.font(size, bold)) / self.scale
+
+    def text(self, x, y, text, size, bold=False, fill=CARD_INK, anchor='la'):
+        self.draw.text((self.px(x), self.px(y)), text, font=self.font(size, bold), fill=fill, anchor=anchor)
+
+    def wrap(self, text, size, max_width, bold=False):
+        lines, line = [], ''
+        for word in str(text).split():
+            candidate = f"{line} {word}".strip()
+            if line and self.text_width(candidate, size, bold) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        if line:
+            lines.append(line)
+        return lines or ['']
+
+    def paragraph(self, x, y, text, size, max_width, line_height, bold=False, fill=CARD_INK, anchor='ma'):
+        """Draw wrapped text starting at y; returns the y below the last line."""
+        for line in self.wrap(text, size, max_width, bold):
+            self.text(x, y, line, size, bold, fill, anchor)
+            y += line_height
+        return y
+
+    def paste(self, img, box, contain=False):
+        x0, y0, x1, y1 = [self.px(v) for v in box]
+        size = (x1 - x0, y1 - y0)
+        if contain:
+            img = ImageOps.contain(img, size, Image.LANCZOS)
+            x0 += (size[0] - img.width) // 2
+            y0 += (size[1] - img.height) // 2
+        else:
+            img = ImageOps.fit(img, size, Image.LANCZOS)
+        mask = img.getchannel('A') if img.mode == 'RGBA' else None
+        self.image.paste(img.convert('RGB'), (x0, y0), mask)
+
+
+def _open_static_image(rel_path):
+    if not rel_path:
+        return None
+    path = os.path.join(app.static_folder, rel_path.split('static/')[-1])
+    try:
+        img = Image.open(path)
+        img.load()
+    except (OSError, ValueError):
+        return None
+    return img.convert('RGBA') if img.mode in ('P', 'LA', 'RGBA') else img.convert('RGB')
+
+def _draw_card_front_layer(c):
+    # header band with logo and university name
+    c.rect((0, 0, 360, 100), fill=CARD_BROWN)
+    c.rect((0, 100, 360, 103), fill=CARD_GOLD)
+    c.draw.ellipse([c.px(v) for v in (20, 15, 90, 85)], fill='white')
+    logo = _open_static_image('uni_logo.png')
+    if logo:
+        c.paste(logo, (22.5, 17.5, 87.5, 82.5), contain=True)
+    name_lines = [wrapped for line in CARD_UNIVERSITY_NAME for wrapped in c.wrap(line.upper(), 12, 240, bold=True)]
+    y = 50 - len(name_lines) * 17 / 2
+    for line in name_lines:
+        c.text(225, y, line, 12, bold=True, fill='white', anchor='ma')
+        y += 17
+
+    # photo frame
+    c.rect((114, 118, 246, 288), fill='white', radius=8, outline='#e2e8f0', width=1)
+
+    # signature block
+    title_width = c.text_width('DIRECTOR ADMISSIONS', 11, True)
+    c.text(340, 480, 'A. Signature', 18, fill=CARD_INK, anchor='rs')
+    c.rect((340 - title_width, 485, 340, 487), fill=CARD_BROWN)
+    c.text(340, 490, 'DIRECTOR ADMISSIONS', 11, bold=True, fill=CARD_INK, anchor='ra')
+
+    # degree footer
+    c.rect((0, 522, 360, 560), fill=CARD_CREAM)
+    c.rect((0, 522, 360, 524), fill=CARD_GOLD)
+
+def _draw_card_front(c, student):
+    variant = 'card' if c.px(124) <= PHOTO_VARIANTS['card'][0] else 'print'
+    photo = _open_static_image(photo_variant(student.get('image_path'), variant))
+    if photo:
+        c.paste(photo, (118, 122, 242, 284))
+    else:
+        c.rect((118, 122, 242, 284), fill='#edf2f7', radius=6)
+        c.text(180, 203, 'No Photo', 13, fill='#a0aec0', anchor='mm')
+
+    # student details
+    y = 298
+    c.text(180, y, f"{student.get('batch') or ''} ({student.get('year') or ''} Years)", 15, bold=True,
+           fill=CARD_MUTED, anchor='ma')
+    y = c.paragraph(180, y + 26, (student.get('name') or '').upper(), 19, 330, 24, bold=True, fill='#1a202c')
+    y = c.paragraph(180, y + 4, f"DEPARTMENT OF {(student.get('department') or '').upper()}", 14, 330, 19,
+                    bold=True, fill=CARD_BROWN)
+    label, roll = 'Class Roll # ', str(student.get('roll_no') or '')
+    total = c.text_width(label, 15, True) + c.text_width(roll, 18, True)
+    x = 180 - total / 2
+    c.text(x, y + 22, label, 15, bold=True, fill=CARD_INK, anchor='ls')
+    c.text(x + c.text_width(label, 15, True), y + 22, roll, 18, bold=True, fill=CARD_BROWN, anchor='ls')
+
+    degree_lines = c.wrap((student.get('degree') or DEFAULT_DEGREE).upper(), 12, 324, bold=True)
+    y = 542 - len(degree_lines) * 15 / 2
+    for line in degree_lines:
+        c.text(180, y, line, 12, bold=True, fill=CARD_INK, anchor='ma')
+        y += 15
+
+def _draw_card_back_layer(c):
+    lines = c.wrap(CARD_RETURN_ADDRESS, 10, 300)
+    c.paragraph(180, 335 - len(lines) * 15, CARD_RETURN_ADDRESS, 10, 300, 15, fill=CARD_MUTED)
+
+    # QR code frame
+    c.rect((124, 369, 236, 480), fill='white', radius=12, outline=CARD_BROWN, width=2)
+
+    # contact bar
+    c.rect((0, 522, 360, 560), fill=CARD_BROWN)
+    c.text(180, 528, CARD_CONTACT_LINES[0], 9, bold=True, fill='white', anchor='ma')
+    c.text(180, 542, CARD_CONTACT_LINES[1], 9, bold=True, fill='white', anchor='ma')
+
+def _draw_card_back(c, student, qr_image):
+    # labels move down with wrapped values, so they are drawn per card
+    y = 20
+    for label, key in CARD_BACK_FIELDS:
+        c.text(20, y, label.upper(), 12, bold=True, fill=CARD_INK)
+        c.text(139, y, ':', 12, bold=True, fill=CARD_INK)
+        y = c.paragraph(151, y, str(student.get(key) or '').upper(), 12, 189, 16, fill=CARD_MUTED, anchor='la') + 7
+
+    if qr_image is not None:
+        x0, y0, x1, y1 = [c.px(v) for v in (132.5, 377.5, 227.5, 472.5)]
+        c.image.paste(qr_image.convert('RGB').resize((x1 - x0, y1 - y0), Image.NEAREST), (x0, y0))
+    c.text(180, 489, f"Valid upto: {student.get('valid_until') or CARD_VALID_UNTIL}", 12, bold=True,
+           fill='#c53030', anchor='ma')
+
+def card_base_layer(side, dpi):
+    """Return the cached (static layer, corner mask) for one side at `dpi`."""
+    check_card_template()
+    layer = card_layer_cache.get((side, dpi))
+    if layer is None:
+        c = CardCanvas(dpi)
+        (_draw_card_back_layer if side == 'back' else _draw_card_front_layer)(c)
+        mask = Image.new('L', c.image.size, 0)
+        ImageDraw.Draw(mask).rounded_rectangle([0, 0, c.image.width - 1, c.image.height - 1],
+                                               radius=c.px(18), fill=255)
+        layer = (c.image, mask)
+        card_layer_cache.put((side, dpi), layer)
+    return layer
+
+def render_id_card(student, side='front', dpi=None):
+    """Render one side of a student's ID card as an RGBA image with rounded corners."""
+    started = time.perf_counter()
+    dpi = dpi or config.CARD_DPI
+    base, mask = card_base_layer(side, dpi)
+    c = CardCanvas(dpi, base.copy())
+    if side == 'back':
+        payload = build_qr_payload(student['name'], student['roll_no'], student['department'],
+                                   student.get('department_degree'), student['batch'], student['year'],
+                                   student['father_name'])
+        _draw_card_back(c, student, render_qr_image(payload))
+    else:
+        _draw_card_front(c, student)
+    card = c.image.convert('RGBA')
+    card.putalpha(mask)
+    record_card_render((time.perf_counter() - started) * 1000)
+    return card
+
+# Card data comes from the student_cards read model (migration 3): one row per
+# student with the degree already resolved, kept current by triggers on
+# students and departments, so card routes need no join.
+CARD_STUDENT_FIELDS = [
+    'id', 'name', 'father_name', 'caste', 'cnic', 'roll_no', 'department', 'batch', 'year',
+    'enrollment', 'emergency_contact', 'relation', 'blood_group', 'address', 'image_path',
+    'qr_code', 'qr_hash', 'department_degree', 'degree', 'version'
+]
+
+CARD_STUDENT_SELECT = f"SELECT {', '.join('s.' + f for f in CARD_STUDENT_FIELDS)} FROM student_cards s"
+
+def _card_student_from_row(row):
+    return dict(zip(CARD_STUDENT_FIELDS, row))
+
+def load_card_data(student_ids):
+    """Card data for one id (a dict, or None) or for a list of ids ({id: dict})."""
+    single = isinstance(student_ids, int)
     conn = get_db_connection()
     cur = conn.cursor()
+    cur.execute(CARD_STUDENT_SELECT + " WHERE s.id = ANY(%s)", ([student_ids] if single else list(student_ids),))
+    cards = {row[0]: _card_student_from_row(row) for row in cur.fetchall()}
+    cur.close()
+    conn.close()
+    return cards.get(student_ids) if single else cards
+
+def iter_card_students(filters, itersize=200, offset=0, limit=None):
+    """Yield card data for generate_id filters (STUDENT_LIST_FILTERS) through
+    a server-side cursor, so only `itersize` rows are held in memory at a time.
+
+    The connection is checked out directly rather than via get_db_connection():
+    streamed responses keep iterating after teardown_appcontext has run.
+    """
+    pool = get_db_pool()
+    conn = PooledConnection(pool, pool.getconn())
+    cur = conn.cursor(name=f"card_students_{uuid.uuid4().hex}")
+    cur.itersize = itersize
+    clauses, params = student_filter_clauses(filters)
+    try:
+        cur.execute(CARD_STUDENT_SELECT + f"""
+            {"WHERE " + " AND ".join(clauses) if clauses else ""}
+            ORDER BY s.name, s.id
+            OFFSET %s LIMIT %s
+        """, params + [offset, limit])
+        for row in cur:
+            yield _card_student_from_row(row)
+    finally:
+        cur.close()
+        conn.close()
 
-    cur.execute("""
-        SELECT s.id, s.name, s.father_name, s.caste, s.cnic, s.roll_no,
-               s.department, s.batch, s.year, s.enrollment,
-               s.emergency_contact, s.relation, s.blood_group, s.address,
-               s.image_path, s.qr_code, d.degree
-        FROM students s
-        LEFT JOIN departments d ON LOWER(s.department) = LOWER(d.name)
-        WHERE s.id = %s
-    """, (student_id,))
-    s = cur.fetchone()
+def count_card_students(filters):
+    clauses, params = student_filter_clauses(filters)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT COUNT(*) FROM student_cards s
+        {"WHERE " + " AND ".join(clauses) if clauses else ""}
+    """, params)
+    total = cur.fetchone()[0]
     cur.close()
     conn.close()
+    return total
 
-    if not s:
+@app.route('/admin/id_card/<int:student_id>.png')
+@role_required('admin')
+def id_card_image(student_id):
+    side = request.args.get('side', 'front')
+    if side not in ('front', 'back'):
+        abort(400)
+    dpi = max(72, min(request.args.get('dpi', config.CARD_DPI, type=int), config.CARD_MAX_DPI))
+
+    student = load_card_data(student_id)
+    if not student:
         abort(404)
 
-    student = {
-        'id': s[0],
-        'name': s[1],
-        'father_name': s[2],
-        'caste': s[3],
-        'cnic': s[4],
-        'roll_no': s[5],
-        'department': s[6],
-        'batch': s[7],
-        'year': s[8],
-        'enrollment': s[9],
-        'emergency_contact': s[10],
-        'relation': s[11],
-        'blood_group': s[12],
-        'address': s[13],
-        'image_path': s[14],
-        'qr_code': s[15],
-        'degree': s[16] or "Bachelor of Engineering Technology"
-    }
-
-    if student['qr_code']:
-        student['qr_code_url'] = url_for('static', filename=student['qr_code'])
-    else:
-        student['qr_code_url'] = None
-
-    return render_template('id_modal.html', student=student)
+    buf = BytesIO()
+    render_id_card(student, side, dpi).save(buf, format='PNG', dpi=(dpi, dpi), compress_level=3)
+    buf.seek(0)
+    return send_file(buf, mimetype='image/png', download_name=f"{student['roll_no']}_{side}.png")
+
+
+# Bulk print sheets: cards laid out N-up on A4 with crop marks, fronts and
+# backs on alternating pages (backs mirrored for long-edge duplex), streamed
+# to the client one page at a time.
+A4_MM = (210.0, 297.0)
+MM_PER_INCH = 25.4
+PT_PER_MM = 72 / MM_PER_INCH
+
+
+class PDFStreamWriter:
+    """Minimal PDF writer that emits each page as soon as it is added.
+
+    Every page is one full-page JPEG image. Object 1 (catalog) and 2 (page
+    tree) are written last, together with the xref table, so nothing but
+    the object offsets is kept in memory.
+    """
+
+    def __init__(self, page_size_mm):
+        self.width_pt = page_size_mm[0] * PT_PER_MM
+        self.height_pt = page_size_mm[1] * PT_PER_MM
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self._next_id = 3
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _object(self, obj_id, body):
+        self.offsets[obj_id] = self.offset
+        return self._emit(f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def _stream(self, obj_id, header, data):
+        return self._object(obj_id, f"<< {header} /Length {len(data)} >>\nstream\n".encode()
+                            + data + b"\nendstream")
+
+    def header(self):
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def page(self, image, quality=90):
+        buf = BytesIO()
+        image.convert('RGB').save(buf, format='JPEG', quality=quality, optimize=True)
+        image_id, content_id, page_id = self._next_id, self._next_id + 1, self._next_id + 2
+        self._next_id += 3
+        self.page_ids.append(page_id)
+
+        w, h = f"{self.width_pt:.2f}", f"{self.height_pt:.2f}"
+        return b"".join([
+            self._stream(image_id, f"/Type /XObject /Subtype /Image /Width {image.width} "
+                                   f"/Height {image.height} /ColorSpace /DeviceRGB "
+                                   f"/BitsPerComponent 8 /Filter /DCTDecode", buf.getvalue()),
+            self._stream(content_id, "", f"q {w} 0 0 {h} 0 0 cm /Im0 Do Q".encode()),
+            self._object(page_id, (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {w} {h}] "
+                                   f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                                   f"/Contents {content_id} 0 R >>").encode()),
+        ])
 
-@app.route('/admin/id_card/<int:student_id>')
+    def trailer(self):
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        out = [
+            self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>"),
+            self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode()),
+        ]
+        xref_offset = self.offset
+        size = self._next_id
+        xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        xref += [f"{self.offsets[i]:010d} 00000 n \n" for i in range(1, size)]
+        xref.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        out.append(self._emit("".join(xref).encode()))
+        return b"".join(out)
+
+
+def print_sheet_layout(dpi):
+    """Card positions (top-left, in pixels) for one A4 sheet at `dpi`."""
+    mm = dpi / MM_PER_INCH
+    card_w, card_h = card_pixel_size(dpi)
+    margin, gutter = config.PRINT_MARGIN_MM * mm, config.PRINT_GUTTER_MM * mm
+    page_w, page_h = round(A4_MM[0] * mm), round(A4_MM[1] * mm)
+    cols = max(1, int((page_w - 2 * margin + gutter) // (card_w + gutter)))
+    rows = max(1, int((page_h - 2 * margin + gutter) // (card_h + gutter)))
+    x0 = (page_w - (cols * card_w + (cols - 1) * gutter)) / 2
+    y0 = (page_h - (rows * card_h + (rows - 1) * gutter)) / 2
+    slots = [(round(x0 + col * (card_w + gutter)), round(y0 + row * (card_h + gutter)))
+             for row in range(rows) for col in range(cols)]
+    return (page_w, page_h), cols, slots
+
+def render_print_sheet(cards, dpi, mirror=False):
+    """Paste up to one sheet of card images onto a white A4 page with crop marks.
+
+    With mirror=True columns are reversed so backs line up with their fronts
+    when the sheet is printed duplex and flipped on the long edge.
+    """
+    (page_w, page_h), cols, slots = print_sheet_layout(dpi)
+    page = Image.new('RGB', (page_w, page_h), 'white')
+    draw = ImageDraw.Draw(page)
+    mm = dpi / MM_PER_INCH
+    gap, length, width = round(0.5 * mm), round(2.5 * mm), max(1, round(0.1 * mm))
+
+    for index, card in enumerate(cards):
+        if mirror:
+            row, col = divmod(index, cols)
+            index = row * cols + (cols - 1 - col)
+        x, y = slots[index]
+        page.paste(card, (x, y), card.getchannel('A') if card.mode == 'RGBA' else None)
+        right, bottom = x + card.width, y + card.height
+        for cx in (x, right):
+            for cy, direction in ((y, -1), (bottom, 1)):
+                draw.line([(cx, cy + direction * gap), (cx, cy + direction * (gap + length))], fill='black', width=width)
+        for cy in (y, bottom):
+            for cx, direction in ((x, -1), (right, 1)):
+                draw.line([(cx + direction * gap, cy), (cx + direction * (gap + length), cy)], fill='black', width=width)
+    return page
+
+def generate_print_sheets(students, dpi=None):
+    """Yield PDF bytes for a stream of students, one front and one back page per sheet."""
+    dpi = dpi or config.PRINT_DPI
+    per_sheet = len(print_sheet_layout(dpi)[2])
+    writer = PDFStreamWriter(A4_MM)
+    yield writer.header()
+    students = iter(students)
+    while True:
+        sheet = list(itertools.islice(students, per_sheet))
+        if not sheet:
+            break
+        yield writer.page(render_print_sheet([render_id_card(s, 'front', dpi) for s in sheet], dpi),
+                          config.PRINT_JPEG_QUALITY)
+        yield writer.page(render_print_sheet([render_id_card(s, 'back', dpi) for s in sheet], dpi, mirror=True),
+                          config.PRINT_JPEG_QUALITY)
+    yield writer.trailer()
+
+@app.route('/admin/print_sheets.pdf', methods=['GET', 'POST'])
 @role_required('admin')
-def generate_id_modal(student_id):
+def print_sheets():
+    filters = request_student_filters()
+    batch, department = filters['batch'], filters['department']
+
+    students = iter_card_students(filters)
+    first = next(students, None)
+    if first is None:
+        flash('No students found for this filter.', 'warning')
+        return redirect(url_for('generate_id'))
+
+    filename = secure_filename(f"id_cards_{batch or 'all'}_{department or 'all'}.pdf")
+    return Response(
+        stream_with_context(generate_print_sheets(itertools.chain([first], students))),
+        mimetype='application/pdf',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+# Streamed ZIP export: one folder per batch with <roll_no>_front.png and
+# <roll_no>_back.png. Entries are written through an unseekable buffer (zip
+# data descriptors) and flushed after every card. Progress is kept in
+# export_jobs (migration 7) so the progress URL works on any worker; while
+# running it is written at most every EXPORT_PROGRESS_INTERVAL seconds.
+EXPORT_PROGRESS_TTL = 3600
+EXPORT_PROGRESS_INTERVAL = 1.0
+EXPORT_JOB_FIELDS = ['id', 'status', 'total', 'range_start', 'range_end', 'done', 'bytes',
+                     'error', 'started_at', 'updated_at']
+
+
+class _ZipStreamBuffer:
+    """Write-only file object for zipfile: tracks the offset, cannot seek."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def create_export_job(export_id, total, start, end):
     conn = get_db_connection()
     cur = conn.cursor()
-
+    cur.execute("DELETE FROM export_jobs WHERE updated_at < now() - %s * interval '1 second'",
+                (EXPORT_PROGRESS_TTL,))
     cur.execute("""
-        SELECT s.id, s.name, s.father_name, s.roll_no, s.batch, s.department,
-               s.year, s.enrollment, s.emergency_contact, s.relation,
-               s.blood_group, s.address, s.image_path, s.qr_code, d.degree
-        FROM students s
-        LEFT JOIN departments d ON LOWER(s.department) = LOWER(d.name)
-        WHERE s.id = %s
-    """, (student_id,))
-    s = cur.fetchone()
+        INSERT INTO export_jobs (id, total, range_start, range_end, done)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (export_id, total, start, end, start))
+    conn.commit()
     cur.close()
     conn.close()
 
-    if not s:
-        flash("Student not found", "danger")
-        return redirect(url_for('admin_dashboard'))
-
-    keys = [
-        'id', 'name', 'father_name', 'roll_no', 'batch', 'department', 'year', 'enrollment',
-        'emergency_contact', 'relation', 'blood_group', 'address', 'image_path', 'qr_code', 'degree'
-    ]
-    student_dict = dict(zip(keys, s))
+def _update_export_progress(export_id, **fields):
+    assignments = [f"{key} = %s" for key in fields] + ["updated_at = now()"]
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"UPDATE export_jobs SET {', '.join(assignments)} WHERE id = %s",
+                list(fields.values()) + [export_id])
+    conn.commit()
+    cur.close()
+    conn.close()
 
-    if student_dict['image_path'] and student_dict['image_path'].startswith('static/'):
-        student_dict['image_path'] = student_dict['image_path'].replace('static/', '')
+def get_export_progress(export_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(EXPORT_JOB_FIELDS)} FROM export_jobs WHERE id = %s", (export_id,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    if not row:
+        return None
+    job = dict(zip(EXPORT_JOB_FIELDS, row))
+    job['start'], job['end'] = job.pop('range_start'), job.pop('range_end')
+    for key in ('started_at', 'updated_at'):
+        job[key] = job[key].isoformat()
+    return job
+
+def card_zip_entry_name(student, side):
+    folder = secure_filename(student['batch'] or '') or 'no_batch'
+    stem = secure_filename(student['roll_no'] or '') or f"student_{student['id']}"
+    return f"{folder}/{stem}_{side}.png"
+
+def generate_card_zip(students, dpi, export_id=None, start=0):
+    """Yield a ZIP archive of front/back PNGs, one flush per student.
+
+    PNGs are already deflated, so entries are STORED. Progress is recorded
+    under `export_id`; `start` is the card index the archive begins at.
+    """
+    buf = _ZipStreamBuffer()
+    done = start
+    reported_at = time.monotonic()
+    try:
+        with zipfile.ZipFile(buf, mode='w', compression=zipfile.ZIP_STORED) as zf:
+            for student in students:
+                for side in ('front', 'back'):
+                    png = BytesIO()
+                    render_id_card(student, side, dpi).save(png, format='PNG', dpi=(dpi, dpi), compress_level=3)
+                    info = zipfile.ZipInfo(card_zip_entry_name(student, side), time.localtime()[:6])
+                    zf.writestr(info, png.getvalue())
+                done += 1
+                if export_id and time.monotonic() - reported_at >= EXPORT_PROGRESS_INTERVAL:
+                    _update_export_progress(export_id, done=done, bytes=buf.tell())
+                    reported_at = time.monotonic()
+                yield buf.drain()
+        yield buf.drain()
+    except GeneratorExit:
+        if export_id:
+            _update_export_progress(export_id, status='aborted', done=done, bytes=buf.tell())
+        raise
+    except Exception as e:
+        # e.g. an unreadable photo; `done` still says where to resume
+        app.logger.exception("Card export %s failed", export_id)
+        if export_id:
+            _update_export_progress(export_id, status='failed', error=str(e), done=done, bytes=buf.tell())
+        raise
+    if export_id:
+        _update_export_progress(export_id, status='finished', done=done, bytes=buf.tell())
+
+@app.route('/admin/export_cards.zip', methods=['GET', 'POST'])
+@role_required('admin')
+def export_cards():
+    """Stream card PNGs for a generate_id filter as a ZIP.
+
+    `start` and `limit` select a slice of the filter (ordered by name, id),
+    so large exports can be fetched in parts or resumed from the last card
+    reported by the progress endpoint.
+    """
+    filters = request_student_filters()
+    batch, department = filters['batch'], filters['department']
+    start = max(0, request.values.get('start', 0, type=int))
+    limit = request.values.get('limit', type=int)
+    dpi = max(72, min(request.values.get('dpi', config.CARD_DPI, type=int), config.CARD_MAX_DPI))
+
+    total = count_card_students(filters)
+    end = total if limit is None else min(total, start + max(0, limit))
+    if start >= end:
+        flash('No students found for this filter.', 'warning')
+        return redirect(url_for('generate_id'))
 
-    # Fallback if department has no degree assigned yet
-    if not student_dict.get('degree'):
-        student_dict['degree'] = "Bachelor of Engineering Technology"
+    export_id = uuid.uuid4().hex
+    create_export_job(export_id, total, start, end)
+    students = iter_card_students(filters, offset=start, limit=end - start)
+
+    name = secure_filename(f"id_cards_{batch or 'all'}_{department or 'all'}")
+    if start or end < total:
+        name += f"_{start + 1}-{end}"
+    return Response(
+        stream_with_context(generate_card_zip(students, dpi, export_id, start)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{name}.zip"',
+            'X-Export-Id': export_id,
+            'X-Export-Total': str(total),
+            'X-Export-Range': f"{start}-{end}",
+            'X-Export-Progress-Url': url_for('export_progress', export_id=export_id),
+        }
+    )
 
-    return render_template('id_modal.html', student=student_dict)
+@app.route('/admin/export_cards/<export_id>')
+@role_required('admin')
+def export_progress(export_id):
+    progress = get_export_progress(export_id)
+    if not progress:
+        return jsonify({'error': 'Unknown export'}), 404
+    return jsonify(progress)
 
 
     # Manage Batches
@@ -821,6 +3180,7 @@ def manage_batches():
             cursor.execute('INSERT INTO batches (name) VALUES (%s)', (batch_name,))
             conn.commit()
             conn.close()
+            invalidate_reference_data('batches')
             flash('Batch added successfully!', 'success')
         elif 'delete_batch' in request.form:
             batch_id = request.form['batch_id']
@@ -829,6 +3189,7 @@ def manage_batches():
             cursor.execute('DELETE FROM batches WHERE id = %s', (batch_id,))
             conn.commit()
             conn.close()
+            invalidate_reference_data('batches')
             flash('Batch deleted successfully!', 'success')
         return redirect(url_for('manage_batches'))
 
@@ -862,7 +3223,9 @@ def manage_departments():
                     'INSERT INTO departments (name, degree) VALUES (%s, %s)',
                     (department_name, degree)
                 )
+                invalidate_previews(cursor)
                 conn.commit()
+                invalidate_reference_data('departments')
                 flash('Department added successfully!', 'success')
             except Exception as e:
                 conn.rollback()
@@ -876,7 +3239,9 @@ def manage_departments():
             department_id = request.form.get('department_id')
             try:
                 cursor.execute('DELETE FROM departments WHERE id = %s', (department_id,))
+                invalidate_previews(cursor)
                 conn.commit()
+                invalidate_reference_data('departments')
                 flash('Department deleted successfully!', 'success')
             except Exception as e:
                 conn.rollback()
@@ -926,36 +3291,10 @@ def edit_student(student_id):
         if 'student_image' in request.files:
             file = request.files['student_image']
             if file and file.filename:
-                UPLOAD_FOLDER = 'static/uploads/students'
-                ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-                MAX_FILE_SIZE = 2 * 1024 * 1024  # 2MB
-
-                if file.content_length and file.content_length > MAX_FILE_SIZE:
-                    flash('File size too large (max 2MB).', 'warning')
-                    cursor.close()
-                    conn.close()
-                    return redirect(request.url)
-
-                if '.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS:
-                    if not os.path.exists(UPLOAD_FOLDER):
-                        os.makedirs(UPLOAD_FOLDER)
-
-                    ext = file.filename.rsplit('.', 1)[1].lower()
-                    filename = f"{roll_no}_{name.replace(' ', '_')}_{int(time.time())}.{ext}"
-                    filename = secure_filename(filename)
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(file_path)
-                    image_path = f"uploads/students/{filename}"
-
-                    # Delete old image
-                    cursor.execute("SELECT image_path FROM students WHERE id = %s", (student_id,))
-                    old_img = cursor.fetchone()
-                    if old_img and old_img[0]:
-                        old_path = os.path.join('static', old_img[0])
-                        if os.path.exists(old_path):
-                            os.remove(old_path)
-                else:
-                    flash('Invalid file type. Only PNG, JPG, JPEG, GIF allowed.', 'warning')
+                try:
+                    image_path = ingest_student_photo(file)
+                except PhotoIngestError as e:
+                    flash(str(e), 'warning')
                     cursor.close()
                     conn.close()
                     return redirect(request.url)
@@ -980,6 +3319,7 @@ def edit_student(student_id):
             WHERE id = %s
         """, (name, father_name, cnic, caste, roll_no, batch, department, year,
               enrollment, emergency_contact, relation, blood_group, address, image_path, student_id))
+        invalidate_previews(cursor, [student_id])
 
         conn.commit()
         cursor.close()
@@ -1001,11 +3341,8 @@ def edit_student(student_id):
     student = dict(zip(columns, student_row))
 
     # Fetch dropdowns
-    cursor.execute("SELECT name FROM batches")
-    batches = [b[0] for b in cursor.fetchall()]
-
-    cursor.execute("SELECT name FROM departments")
-    departments = [d[0] for d in cursor.fetchall()]
+    batches = reference_names('batches')
+    departments = reference_names('departments')
 
     cursor.close()
     conn.close()
@@ -1018,211 +3355,536 @@ def delete_student(student_id):
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Fetch student image
-    cursor.execute("SELECT image_path FROM students WHERE id = %s", (student_id,))
-    student = cursor.fetchone()
-
-    # Delete student record
+    # Delete student record; its photo and QR files are shared by content
+    # hash and are reclaimed by the file GC once nothing references them.
     cursor.execute("DELETE FROM students WHERE id = %s", (student_id,))
+    invalidate_previews(cursor, [student_id])
     conn.commit()
 
-    # Remove image if exists
-    if student and student[0]:
-        img_path = os.path.join('static', student[0])
-        if os.path.exists(img_path):
-            os.remove(img_path)
-
     cursor.close()
     conn.close()
     flash("Student record deleted successfully.", 'success')
     return redirect(url_for('students_dashboard'))
 
-@app.route('/ai/message', methods=['POST'])
-def ai_message():
-    data = request.get_json(silent=True)
-    if not data or 'message' not in data:
-        return jsonify({"message": "No message provided"}), 400
+# ---------------------------------------------------------------------------
+# n8n workflow client
+# ---------------------------------------------------------------------------
+# One keep-alive session is shared by all chat requests. Each workflow has
+# its own circuit breaker: after N8N_BREAKER_FAILURES consecutive failures
+# (connection errors, timeouts or 5xx) calls fail immediately with
+# CircuitOpenError until N8N_BREAKER_RESET seconds pass; then a single probe
+# request is let through and its outcome closes or re-opens the circuit.
+N8N_WORKFLOWS = {
+    'department': 'ai-department-agent',
+    'page_navigation': 'ai-page-navigation-agent',
+    'batch': 'ai-batch-agent',
+}
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a workflow's circuit is open."""
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            # Open, or half-open with the probe still in flight.
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class WorkflowClient:
+    def __init__(self, base_url, workflows, connect_timeout, read_timeout,
+                 pool_size, failure_threshold, reset_timeout):
+        self.base_url = base_url.rstrip('/')
+        self.workflows = dict(workflows)
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        # No transparent retries: the breaker decides when to try again.
+        adapter = HTTPAdapter(pool_connections=len(self.workflows), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._breakers = {name: CircuitBreaker(failure_threshold, reset_timeout) for name in self.workflows}
+        self._stats = {name: {'requests': 0, 'errors': 0, 'rejected': 0,
+                              'latency_ms_total': 0.0, 'latency_ms_max': 0.0}
+                       for name in self.workflows}
+        self._lock = threading.Lock()
+
+    def url(self, workflow):
+        return f"{self.base_url}/{self.workflows[workflow]}"
+
+    def _record(self, workflow, elapsed_ms=None, error=False, rejected=False):
+        with self._lock:
+            stats = self._stats[workflow]
+            if rejected:
+                stats['rejected'] += 1
+                return
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['latency_ms_total'] += elapsed_ms
+            stats['latency_ms_max'] = max(stats['latency_ms_max'], elapsed_ms)
+
+    def post(self, workflow, payload):
+        """POST payload to a workflow webhook and return the response."""
+        breaker = self._breakers[workflow]
+        if not breaker.allow():
+            self._record(workflow, rejected=True)
+            raise CircuitOpenError(f"{workflow} workflow circuit is open")
+        started = time.perf_counter()
+        try:
+            response = self.session.post(self.url(workflow), json=payload, timeout=self.timeout)
+        except BaseException:
+            # Anything, including a killed greenlet or gevent.Timeout, must
+            # settle the breaker or a half-open probe would block it for good.
+            breaker.record_failure()
+            self._record(workflow, (time.perf_counter() - started) * 1000, error=True)
+            raise
+        failed = response.status_code >= 500
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        self._record(workflow, (time.perf_counter() - started) * 1000, error=failed)
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = {name: dict(values) for name, values in self._stats.items()}
+        for name, values in stats.items():
+            total = values.pop('latency_ms_total')
+            values['latency_ms_avg'] = round(total / values['requests'], 2) if values['requests'] else 0.0
+            values['latency_ms_max'] = round(values['latency_ms_max'], 2)
+            values['circuit'] = self._breakers[name].state
+        return stats
+
+n8n_client = WorkflowClient(
+    config.N8N_BASE_URL, N8N_WORKFLOWS,
+    config.N8N_CONNECT_TIMEOUT, config.N8N_READ_TIMEOUT, config.N8N_POOL_SIZE,
+    config.N8N_BREAKER_FAILURES, config.N8N_BREAKER_RESET,
+)
 
-    user_msg = data['message']
-    print(f"📨 User message: '{user_msg}'")
+@app.cli.command('n8n-selftest')
+def n8n_selftest_command():
+    """Exercise the workflow client against a local stub webhook server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-    # 🎯 NEW: Handle logout commands immediately (HIGHEST PRIORITY)
-    user_msg_lower = user_msg.lower().strip()
-    
-    logout_keywords = [
-        'logout', 'log out', 'signout', 'sign out',
-        'log off', 'sign off', 'shut', 'shut off', 'switch off', 'unplug', 'end session', 'home', 'home page'
-    ]
-    
-    if any(keyword in user_msg_lower for keyword in logout_keywords):
-        print("🎯 Detected LOGOUT command")
-        return jsonify({
-            "message": "👋 Goodbye Admin, logging out!",
-            "redirect_url": "/logout",
-            "action": "logout",
-            "delay": 7000  # 7 seconds delay
-        })
+    stub = {'status': 200, 'connections': 0}
 
-    # 🎯 NEW: Handle close AI assistant commands
-    close_ai_keywords = [
-        'close', 'quit', 'exit', 'leave', 'stop', 'finish', 'close ai', 
-        'goodbye kazmi', 'bye kazmi', 'see you kazmi', 'see you', 'bye', 'goodbye', 'discontinue',
-        'close chat', 'exit chat', 'end chat', 'stop chat'
-    ]
-    
-    if any(keyword in user_msg_lower for keyword in close_ai_keywords):
-        print("🎯 Detected CLOSE AI command")
-        return jsonify({
-            "message": "👋 See you next time!",
-            "action": "close_chat",
-            "delay": 3500  # 3.5 seconds delay
-        })
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
 
-    # 🎯 Handle back/return commands
-    if user_msg_lower in ['back', 'return', 'go back', 'main page', 'admin page']:
-        print("🎯 Detected BACK/RETURN command")
-        return jsonify({
-            "message": "🔙 Returning to main admin page...",
-            "redirect_url": "/admin",
-            "action": "redirect"
-        })
+        def setup(self):
+            super().setup()
+            stub['connections'] += 1
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            body = json.dumps({'message': 'ok'}).encode()
+            self.send_response(stub['status'])
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = WorkflowClient(f"http://127.0.0.1:{server.server_port}", N8N_WORKFLOWS,
+                            1, 2, 2, failure_threshold=2, reset_timeout=0.5)
+
+    def check(label, ok):
+        click.echo(f"{'ok  ' if ok else 'FAIL'} {label}")
+        return ok
 
-    # Smart routing based on message content
-    # 🎯 FIXED: More specific page navigation patterns
-    page_nav_patterns = [
+    try:
+        results = []
+        for _ in range(5):
+            client.post('batch', {'message': 'list batches'})
+        results.append(check(f"keep-alive: 5 requests over {stub['connections']} connection(s)",
+                             stub['connections'] == 1))
+
+        stub['status'] = 500
+        for _ in range(2):
+            client.post('batch', {'message': 'list batches'})
+        try:
+            client.post('batch', {'message': 'list batches'})
+            opened = False
+        except CircuitOpenError:
+            opened = True
+        results.append(check('circuit opens after repeated 5xx and fails fast', opened))
+        results.append(check('other workflows are unaffected',
+                             client.post('department', {'message': '1'}).status_code == 500))
+
+        stub['status'] = 200
+        time.sleep(0.6)
+        probe = client.post('batch', {'message': 'list batches'})
+        results.append(check('probe after reset timeout closes the circuit',
+                             probe.status_code == 200 and client.stats()['batch']['circuit'] == 'closed'))
+
+        server.shutdown()
+        server.server_close()
+        client.session.close()
+        for _ in range(2):
+            try:
+                client.post('page_navigation', {'message': 'open page a'})
+            except requests.exceptions.ConnectionError:
+                pass
+        results.append(check('connection errors open the circuit',
+                             client.stats()['page_navigation']['circuit'] == 'open'))
+        click.echo(json.dumps(client.stats(), indent=2))
+    finally:
+        server.server_close()
+    if not all(results):
+        raise SystemExit(1)
+
+# ---------------------------------------------------------------------------
+# Chat intent matching
+# ---------------------------------------------------------------------------
+# Every phrase list is compiled into a single regex that is scanned once per
+# message. Phrases only match on word boundaries (so '1' or 'bs' no longer
+# fire inside 'bscs-21' or '2024'), whitespace inside a phrase is flexible and
+# the nouns below also match their plurals. Intents are listed in priority
+# order: when a message matches several, the first one listed wins.
+AI_INTENTS = (
+    ('logout', (
+        'logout', 'log out', 'signout', 'sign out', 'log off', 'sign off',
+        'shut', 'shut off', 'switch off', 'unplug', 'end session', 'home', 'home page',
+    )),
+    ('close_chat', (
+        'close', 'quit', 'exit', 'leave', 'stop', 'finish', 'close ai',
+        'goodbye kazmi', 'bye kazmi', 'see you kazmi', 'see you', 'bye', 'goodbye',
+        'discontinue', 'close chat', 'exit chat', 'end chat', 'stop chat',
+    )),
+    # Only when it is the whole message.
+    ('back', ('back', 'return', 'go back', 'main page', 'admin page')),
+    ('page_navigation', (
         'enter page', 'open page', 'go to page', 'navigate to page', 'access page',
         'enter a', 'open a', 'go to a', 'enter b', 'open b', 'go to b',
         'enter c', 'open c', 'go to c', 'enter d', 'open d', 'go to d',
-        'import page', 'generate ids page', 'manage batches page', 'manage departments page'
-    ]
-    
-    # Department-related keywords
-    department_keywords = [
-        'department', 'dept', 
-        'computer science', 'electrical', 'mechanical', 'civil', 
-        'software', 'artificial intelligence', 'bba', 'mba',
-        'bachelor of science', 'bachelor of engineering',
+        'import page', 'generate ids page', 'manage batches page', 'manage departments page',
+    )),
+    ('department', (
         'show department', 'list department', 'view department', 'departments',
-        'delete department', 'remove department', 'del department', 
         'add department', 'create department', 'new department',
-        '1', '2', 'bs', 'bet'
-    ]
-    
-    # Batch-related keywords  
-    batch_keywords = [
+        'delete department', 'remove department', 'del department',
+        '1', '2', 'bs', 'bet',
+    )),
+    ('batch', (
         'batch', 'bscs', 'mscs', 'bsit', 'bsse',
         'show batch', 'list batch', 'view batch',
         'delete batch', 'remove batch', 'del batch',
-        'add batch', 'create batch', 'new batch'
-    ]
-    
-    # Determine which workflow to call with priority logic
-    workflow_type = "batch"  # Default to batch
-    
-    # 🎯 FIXED: Check for EXACT page navigation patterns first
-    has_exact_page_nav = any(pattern in user_msg_lower for pattern in page_nav_patterns)
-    
-    if has_exact_page_nav:
-        workflow_type = "page_navigation"
-        print("🎯 Detected as PAGE NAVIGATION command")
-    
-    # 🎯 FIXED: Check for department operations with specific commands
-    elif any(keyword in user_msg_lower for keyword in department_keywords):
-        # Make sure it's a department OPERATION, not navigation
-        is_department_operation = any(cmd in user_msg_lower for cmd in [
-            'show department', 'list department', 'view department', 'departments',
-            'add department', 'create department', 'new department',
-            'delete department', 'remove department', 'del department',
-            '1', '2', 'bs', 'bet'
-        ])
-        
-        if is_department_operation:
-            workflow_type = "department"
-            print("🎯 Detected as DEPARTMENT operation")
-    
-    # 🎯 FIXED: Check for batch operations with specific commands
-    elif any(keyword in user_msg_lower for keyword in batch_keywords):
-        # Make sure it's a batch OPERATION, not navigation
-        is_batch_operation = any(cmd in user_msg_lower for cmd in [
-            'show batch', 'list batch', 'view batch', 'batches',
-            'add batch', 'create batch', 'new batch',
-            'delete batch', 'remove batch', 'del batch'
-        ])
-        
-        if is_batch_operation:
-            workflow_type = "batch"
-            print("🎯 Detected as BATCH operation")
-    
-    # Set the n8n URL based on workflow type
-    if workflow_type == "department":
-        n8n_url = "http://localhost:5678/webhook/ai-department-agent"
-    elif workflow_type == "page_navigation":
-        n8n_url = "http://localhost:5678/webhook/ai-page-navigation-agent"
-    else:
-        n8n_url = "http://localhost:5678/webhook/ai-batch-agent"
-    
-    print(f"🔄 Routing to {workflow_type.upper()} workflow: {n8n_url}")
+        'add batch', 'create batch', 'new batch',
+    )),
+)
+AI_WHOLE_MESSAGE_INTENTS = {'back'}
+AI_INTENT_PLURALS = {'department': 's', 'batch': 'es', 'page': 's'}
+AI_DEFAULT_INTENT = 'batch'
+AI_INTENT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_corpus.json')
+
+def _intent_phrase_pattern(phrase):
+    words = []
+    for word in phrase.split():
+        pattern = re.escape(word)
+        if word in AI_INTENT_PLURALS:
+            pattern += f"(?:{AI_INTENT_PLURALS[word]})?"
+        words.append(pattern)
+    return r'\s+'.join(words)
+
+def compile_intent_matcher(intents=AI_INTENTS):
+    """Build the combined matcher: one named group per intent, longest
+    phrases first so 'close chat' is preferred over 'close'."""
+    groups = []
+    for intent, phrases in intents:
+        ordered = sorted(set(phrases), key=lambda p: (-len(p), p))
+        body = '|'.join(_intent_phrase_pattern(p) for p in ordered)
+        if intent in AI_WHOLE_MESSAGE_INTENTS:
+            groups.append(rf"(?P<{intent}>\A(?:{body})\Z)")
+        else:
+            groups.append(rf"(?P<{intent}>(?<!\w)(?:{body})(?!\w))")
+    # The lookahead makes every match zero-width, so a phrase never hides an
+    # overlapping phrase of another intent that starts further on.
+    return re.compile(rf"(?=(?:{'|'.join(groups)}))")
+
+AI_INTENT_PRIORITY = tuple(intent for intent, _ in AI_INTENTS)
+AI_INTENT_RE = compile_intent_matcher()
+
+def classify_message(message):
+    """Return (intent, set of every intent found) for a chat message."""
+    text = ' '.join(message.lower().split())
+    found = {match.lastgroup for match in AI_INTENT_RE.finditer(text)}
+    for intent in AI_INTENT_PRIORITY:
+        if intent in found:
+            return intent, found
+    return AI_DEFAULT_INTENT, found
+
+@app.cli.command('bench-intents')
+@click.option('--corpus', default=AI_INTENT_CORPUS, show_default=True,
+              type=click.Path(exists=True, dir_okay=False), help='Labeled messages (JSON).')
+@click.option('--repeat', default=200, show_default=True, help='Timing passes over the corpus.')
+def bench_intents_command(corpus, repeat):
+    """Check the intent matcher against a labeled corpus and time it."""
+    with open(corpus) as f:
+        cases = json.load(f)
+
+    failures = 0
+    for case in cases:
+        intent, found = classify_message(case['message'])
+        if intent != case['intent']:
+            failures += 1
+            click.echo(f"MISMATCH {case['message']!r}: expected {case['intent']}, "
+                       f"got {intent} (found {sorted(found)})")
+
+    messages = [case['message'] for case in cases]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            classify_message(message)
+    elapsed = time.perf_counter() - started
+    calls = repeat * len(messages)
+    click.echo(f"{len(cases) - failures}/{len(cases)} correct; "
+               f"{elapsed / calls * 1e6:.2f} µs/message over {calls} calls")
+    if failures:
+        raise SystemExit(1)
+
+# ---------------------------------------------------------------------------
+# Local read-only chat queries
+# ---------------------------------------------------------------------------
+# Listing batches/departments and counting students only reads our own
+# tables, so those messages are answered here instead of by an n8n
+# workflow. Only whole messages in these shapes qualify; anything that
+# mutates data or asks something open-ended still goes to n8n.
+LOCAL_QUERY_RE = re.compile(r"""
+    (?:(?:please|can\ you|could\ you)\ )?
+    (?:
+        (?P<list_departments>(?:show|list|view|display|get)(?:\ (?:all|the|all\ the))?\ departments?)
+      | (?P<list_batches>(?:show|list|view|display|get)(?:\ (?:all|the|all\ the))?\ batch(?:es)?)
+      | (?P<count_students>
+            (?:how\ many\ students|(?:total|number\ of|count)\ (?:of\ )?students|students?\ count)
+            (?:\ (?:are\ )?(?:in|of|for)\ (?:the\ )?(?P<scope>.+?))?
+            (?:\ (?:are\ there|do\ we\ have))?
+        )
+    )
+    (?:\ please)?
+""", re.X)
+
+def match_local_query(message):
+    """Return (query, scope) when the message is a read-only query we can answer."""
+    text = ' '.join(message.lower().split()).strip(' .!?')
+    match = LOCAL_QUERY_RE.fullmatch(text)
+    if not match:
+        return None
+    query = next(name for name in ('list_departments', 'list_batches', 'count_students') if match.group(name))
+    return query, match.group('scope')
+
+def _resolve_scope(scope):
+    scope = re.sub(r'\s+(?:batch|department)$', '', scope.strip())
+    scope = re.sub(r'^(?:batch|department)\s+', '', scope)
+    for kind, column in (('batches', 'batch'), ('departments', 'department')):
+        for name in reference_names(kind):
+            if name.lower() == scope:
+                return column, name
+    return None
+
+def run_local_query(query, scope=None):
+    """Answer a read-only chat query, or return None to defer to n8n."""
+    if query in ('list_departments', 'list_batches'):
+        kind = 'departments' if query == 'list_departments' else 'batches'
+        names = reference_names(kind)
+        if not names:
+            return f"No {kind} found."
+        return f"📋 {kind.capitalize()} ({len(names)}):\n" + '\n'.join(f"• {name}" for name in names)
+
+    if scope:
+        resolved = _resolve_scope(scope)
+        if resolved is None:
+            return None
+        column, name = resolved
+        conn = get_db_connection()
+        cur = conn.cursor()
+        # column comes from _resolve_scope, never from the message
+        cur.execute(f"SELECT COUNT(*) FROM students WHERE {column} = %s", (name,))
+        count = cur.fetchone()[0]
+        cur.close()
+        conn.close()
+        return f"👥 {count} student{'s' if count != 1 else ''} in {column} {name}."
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT department, COUNT(*) FROM students GROUP BY department ORDER BY department")
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    total = sum(count for _, count in rows)
+    lines = [f"👥 Total students: {total}"]
+    lines.extend(f"• {department}: {count}" for department, count in rows)
+    return '\n'.join(lines)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def ai_message_events(user_msg):
+    """Process a chat message, yielding (event, data) pairs as it goes:
+    'route' once the intent and serving path are known, then 'status'
+    updates. Returns the final (reply, http_status)."""
+    print(f"📨 User message: '{user_msg}'")
+
+    # One pass over the message finds every intent; the highest-priority one wins.
+    workflow_type, _ = classify_message(user_msg)
+    print(f"🎯 Detected as {workflow_type.upper()} intent")
+
+    if workflow_type == 'logout':
+        yield 'route', {"intent": workflow_type, "served_by": "local"}
+        return {
+            "message": "👋 Goodbye Admin, logging out!",
+            "redirect_url": "/logout",
+            "action": "logout",
+            "delay": 7000,  # 7 seconds delay
+            "served_by": "local"
+        }, 200
+
+    if workflow_type == 'close_chat':
+        yield 'route', {"intent": workflow_type, "served_by": "local"}
+        return {
+            "message": "👋 See you next time!",
+            "action": "close_chat",
+            "delay": 3500,  # 3.5 seconds delay
+            "served_by": "local"
+        }, 200
+
+    if workflow_type == 'back':
+        yield 'route', {"intent": workflow_type, "served_by": "local"}
+        return {
+            "message": "🔙 Returning to main admin page...",
+            "redirect_url": "/admin",
+            "action": "redirect",
+            "served_by": "local"
+        }, 200
+
+    # Read-only batch/department queries are answered from our own tables.
+    if workflow_type in ('batch', 'department'):
+        local = match_local_query(user_msg)
+        answer = run_local_query(*local) if local else None
+        if answer is not None:
+            print(f"⚡ Answered {local[0]} locally")
+            yield 'route', {"intent": workflow_type, "served_by": "local"}
+            return {"message": answer, "served_by": "local"}, 200
+
+    print(f"🔄 Routing to {workflow_type.upper()} workflow: {n8n_client.url(workflow_type)}")
+    yield 'route', {"intent": workflow_type, "served_by": "n8n"}
+    yield 'status', {"message": f"Asking the {workflow_type.replace('_', ' ')} workflow..."}
 
     try:
-        response = requests.post(
-            n8n_url,
-            json={"message": user_msg},
-            timeout=15
-        )
+        started = time.perf_counter()
+        response = n8n_client.post(workflow_type, {"message": user_msg})
         
         print(f"📡 Response status: {response.status_code}")
         
         # Handle HTTP errors
         if response.status_code != 200:
             print(f"❌ HTTP Error: {response.text}")
-            error_msg = "Workflow returned an error. Please try again."
-            if workflow_type == "page_navigation":
-                return jsonify({"message": error_msg, "action": "message"})
-            else:
-                return jsonify({"message": error_msg}), 500
+            return workflow_error(workflow_type, "Workflow returned an error. Please try again.")
         
         # Parse JSON response
         result = response.json()
         print(f"📊 Raw n8n response: {result}")
+        yield 'status', {"message": f"Workflow replied in {time.perf_counter() - started:.1f}s"}
         
         # SPECIAL HANDLING FOR PAGE NAVIGATION WORKFLOW
         if workflow_type == "page_navigation":
-            return handle_page_navigation_response(result, user_msg)
+            return handle_page_navigation_response(result, user_msg), 200
         else:
-            return handle_operation_response(result)
+            return handle_operation_response(result), 200
 
+    except CircuitOpenError:
+        print(f"⛔ {workflow_type} workflow circuit open, failing fast")
+        return workflow_error(workflow_type, "Workflow engine is unavailable. Please try again shortly.", 503)
     except requests.exceptions.ConnectionError:
         print("❌ Connection error to n8n")
-        error_msg = "Cannot connect to workflow engine. Please try again later."
-        if workflow_type == "page_navigation":
-            return jsonify({"message": error_msg, "action": "message"})
-        else:
-            return jsonify({"message": error_msg}), 500
+        return workflow_error(workflow_type, "Cannot connect to workflow engine. Please try again later.")
     except requests.exceptions.Timeout:
         print("⏰ Request timeout")
-        error_msg = "Request timeout. Please try again."
-        if workflow_type == "page_navigation":
-            return jsonify({"message": error_msg, "action": "message"})
-        else:
-            return jsonify({"message": error_msg}), 500
+        return workflow_error(workflow_type, "Request timeout. Please try again.")
     except requests.exceptions.RequestException as e:
         print(f"🔧 Request exception: {e}")
-        error_msg = f"Workflow error: {str(e)}"
-        if workflow_type == "page_navigation":
-            return jsonify({"message": error_msg, "action": "message"})
-        else:
-            return jsonify({"message": error_msg}), 500
+        return workflow_error(workflow_type, f"Workflow error: {str(e)}")
     except Exception as e:
         print(f"💥 Unexpected error: {e}")
-        error_msg = "An unexpected error occurred. Please try again."
-        if workflow_type == "page_navigation":
-            return jsonify({"message": error_msg, "action": "message"})
-        else:
-            return jsonify({"message": error_msg}), 500
+        return workflow_error(workflow_type, "An unexpected error occurred. Please try again.")
+
+
+def workflow_error(workflow_type, error_msg, status=500):
+    """Error reply for a failed n8n call; the page navigation UI expects a 200 message."""
+    if workflow_type == "page_navigation":
+        return {"message": error_msg, "action": "message", "served_by": "n8n"}, 200
+    return {"message": error_msg, "served_by": "n8n"}, status
+
+
+@app.route('/ai/message', methods=['POST'])
+@role_required('admin')
+def ai_message():
+    data = request.get_json(silent=True)
+    if not data or 'message' not in data:
+        return jsonify({"message": "No message provided"}), 400
+
+    events = ai_message_events(data['message'])
+    try:
+        while True:
+            next(events)
+    except StopIteration as done:
+        reply, status = done.value
+    return jsonify(reply), status
+
+# Same as /ai/message, but streamed as Server-Sent Events: 'route' and
+# 'status' events as they happen, then the reply as a 'message' event.
+# Under gevent (GEVENT=1 or a gevent worker) an open stream is a greenlet
+# waiting on the n8n socket, not a pinned thread.
+@app.route('/ai/message/stream', methods=['POST'])
+@role_required('admin')
+def ai_message_stream():
+    data = request.get_json(silent=True)
+    if not data or 'message' not in data:
+        return jsonify({"message": "No message provided"}), 400
+
+    def generate():
+        events = ai_message_events(data['message'])
+        try:
+            while True:
+                yield sse_event(*next(events))
+        except StopIteration as done:
+            reply, _ = done.value
+            yield sse_event('message', reply)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def handle_page_navigation_response(result, original_message):
-    """Handle responses specifically from page navigation workflow"""
+    """Reply dict for a page navigation workflow response"""
     try:
         friendly_message = "Ready to navigate..."
         redirect_url = ""
@@ -1256,23 +3918,25 @@ def handle_page_navigation_response(result, original_message):
         print(f"🎯 Page navigation - Redirect URL: {redirect_url}")
         print(f"🎯 Page navigation - Action: {action}")
         
-        # Return structured response for page navigation
-        return jsonify({
+        # Structured reply for page navigation
+        return {
             "message": friendly_message,
             "redirect_url": redirect_url,
-            "action": action
-        })
+            "action": action,
+            "served_by": "n8n"
+        }
         
     except Exception as e:
         print(f"💥 Error handling page navigation response: {e}")
-        return jsonify({
+        return {
             "message": "❌ Navigation error. Please try again.",
-            "action": "message"
-        })
+            "action": "message",
+            "served_by": "n8n"
+        }
 
 
 def handle_operation_response(result):
-    """Handle responses from department/batch operation workflows"""
+    """Reply dict for a department/batch operation workflow response"""
     try:
         friendly_message = "Action completed successfully"
         
@@ -1309,11 +3973,11 @@ def handle_operation_response(result):
         friendly_message = friendly_message.replace('{', '').replace('}', '')
         
         print(f"📤 Final operation message: {friendly_message}")
-        return jsonify({"message": friendly_message})
+        return {"message": friendly_message, "served_by": "n8n"}
         
     except Exception as e:
         print(f"💥 Error handling operation response: {e}")
-        return jsonify({"message": "Action completed with issues"})
+        return {"message": "Action completed with issues", "served_by": "n8n"}
     
 @app.route('/ai/chat')
 @role_required('admin')
@@ -1324,4 +3988,9 @@ def ai_chat_page():
 if __name__ == '__main__':
     #init_db()
     #app.run(debug=True)
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    if config.GEVENT:
+        from gevent.pywsgi import WSGIServer
+        print("🚀 Serving on gevent at http://0.0.0.0:5000")
+        WSGIServer(("0.0.0.0", 5000), app).serve_forever()
+    else:
+        app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-change-me')
 DB_HOST = os.environ.get('DB_HOST', 'localhost')
@@ -7,3 +8,92 @@ DB_USER = os.environ.get('DB_USER', 'admission_user')
 DB_PASSWORD = os.environ.get('DB_PASSWORD', 'student@123')
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'static/uploads/student_images')
 ALLOWED_IMAGE_EXT = {'png','jpg','jpeg','gif'}
+
+# PostgreSQL connection pool
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', 30))  # idle seconds before SELECT 1 on checkout
+DB_POOL_GEVENT = os.environ.get('DB_POOL_GEVENT', 'auto')  # 'auto', '1' or '0'
+
+# Seconds a cached "no admin yet" answer is trusted before re-checking the DB
+ADMIN_EXISTS_TTL = float(os.environ.get('ADMIN_EXISTS_TTL', 30))
+
+# Student file imports are read and upserted in chunks of this many rows
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+# 'file': one transaction for the whole file; 'chunk': commit after every chunk
+IMPORT_COMMIT_POLICY = os.environ.get('IMPORT_COMMIT_POLICY', 'file')
+# Background import jobs: how many run at once, and where uploads wait for a worker
+IMPORT_MAX_CONCURRENT = int(os.environ.get('IMPORT_MAX_CONCURRENT', 2))
+IMPORT_SPOOL_FOLDER = os.environ.get('IMPORT_SPOOL_FOLDER', os.path.join(tempfile.gettempdir(), 'student_imports'))
+# Unfinished import jobs owned by another host are failed after this many seconds without progress
+IMPORT_JOB_STALE_SECONDS = int(os.environ.get('IMPORT_JOB_STALE_SECONDS', 3600))
+
+# QR rendering: worker processes for large generate_id batches, the batch size
+# below which rendering stays on the request thread, and students per worker task
+# (0 = sized automatically)
+QR_WORKERS = int(os.environ.get('QR_WORKERS', os.cpu_count() or 1))
+QR_PARALLEL_THRESHOLD = int(os.environ.get('QR_PARALLEL_THRESHOLD', 64))
+QR_CHUNK_SIZE = int(os.environ.get('QR_CHUNK_SIZE', 0))
+# Write qr_{id}.png files while listing students in generate_id. Off by default:
+# cards use the on-demand /admin/qr/<id>.png endpoint instead.
+QR_EAGER_GENERATION = os.environ.get('QR_EAGER_GENERATION', '0') == '1'
+# Rendered QR PNGs kept in memory by the on-demand endpoint
+QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', 512))
+
+# Server-side ID card rendering
+CARD_DPI = int(os.environ.get('CARD_DPI', 300))
+CARD_MAX_DPI = int(os.environ.get('CARD_MAX_DPI', 600))
+# TrueType files (path or a name Pillow can find in the system font folders)
+CARD_FONT_REGULAR = os.environ.get('CARD_FONT_REGULAR', 'DejaVuSans.ttf')
+CARD_FONT_BOLD = os.environ.get('CARD_FONT_BOLD', 'DejaVuSans-Bold.ttf')
+
+# Bulk print sheets (A4, N-up with crop marks)
+PRINT_DPI = int(os.environ.get('PRINT_DPI', 300))
+PRINT_MARGIN_MM = float(os.environ.get('PRINT_MARGIN_MM', 10))
+PRINT_GUTTER_MM = float(os.environ.get('PRINT_GUTTER_MM', 6))
+PRINT_JPEG_QUALITY = int(os.environ.get('PRINT_JPEG_QUALITY', 90))
+
+# Card compositor: cached static layers (one per side and DPI)
+CARD_LAYER_CACHE_SIZE = int(os.environ.get('CARD_LAYER_CACHE_SIZE', 16))
+# Seconds between checks of the card template assets for changes on disk
+CARD_TEMPLATE_CHECK_INTERVAL = float(os.environ.get('CARD_TEMPLATE_CHECK_INTERVAL', 2))
+
+# Student photo derivatives: preferred encoding (WEBP falls back to JPEG) and upload limit
+PHOTO_FORMAT = os.environ.get('PHOTO_FORMAT', 'WEBP')
+PHOTO_QUALITY = int(os.environ.get('PHOTO_QUALITY', 82))
+PHOTO_MAX_UPLOAD_BYTES = int(os.environ.get('PHOTO_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+
+# Orphan file GC: files younger than this are never collected (uploads not yet committed)
+FILE_GC_GRACE_SECONDS = int(os.environ.get('FILE_GC_GRACE_SECONDS', 3600))
+
+# Rows per page in the generate_id listing (keyset paginated)
+GENERATE_PAGE_SIZE = int(os.environ.get('GENERATE_PAGE_SIZE', 50))
+
+# Reference data (batch/department names) cache, invalidated via LISTEN/NOTIFY; '0' disables
+REFERENCE_CACHE_ENABLED = os.environ.get('REFERENCE_CACHE_ENABLED', '1') == '1'
+# Seconds before the LISTEN/NOTIFY cache-invalidation listener reconnects after losing its connection
+NOTIFY_LISTEN_RETRY = float(os.environ.get('NOTIFY_LISTEN_RETRY', 5))
+
+# Rendered id_preview fragments kept per process (entries and total bytes)
+PREVIEW_CACHE_SIZE = int(os.environ.get('PREVIEW_CACHE_SIZE', 2048))
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Fingerprinted static assets: build output folder, whether to (re)build at startup
+ASSET_BUILD_FOLDER = os.environ.get('ASSET_BUILD_FOLDER', 'static_build')
+ASSET_BUILD_ON_STARTUP = os.environ.get('ASSET_BUILD_ON_STARTUP', '1') == '1'
+# Images at least this large are re-encoded; widths of the extra resized variants
+ASSET_REENCODE_MIN_BYTES = int(os.environ.get('ASSET_REENCODE_MIN_BYTES', 32 * 1024))
+ASSET_IMAGE_WIDTHS = tuple(int(w) for w in os.environ.get('ASSET_IMAGE_WIDTHS', '640,1280,1920').split(','))
+
+# n8n workflow engine: webhook base URL, connect/read timeouts (seconds) and keep-alive connections per workflow
+N8N_BASE_URL = os.environ.get('N8N_BASE_URL', 'http://localhost:5678/webhook')
+N8N_CONNECT_TIMEOUT = float(os.environ.get('N8N_CONNECT_TIMEOUT', 2))
+N8N_READ_TIMEOUT = float(os.environ.get('N8N_READ_TIMEOUT', 15))
+N8N_POOL_SIZE = int(os.environ.get('N8N_POOL_SIZE', 10))
+# Per-workflow circuit breaker: consecutive failures before failing fast, seconds before a recovery probe
+N8N_BREAKER_FAILURES = int(os.environ.get('N8N_BREAKER_FAILURES', 3))
+N8N_BREAKER_RESET = float(os.environ.get('N8N_BREAKER_RESET', 30))
+
+# Serve `python Code.py` with gevent's WSGIServer so streamed chat replies don't each hold a thread
+GEVENT = os.environ.get('GEVENT', '0') == '1'